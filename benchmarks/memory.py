@@ -0,0 +1,33 @@
+"""Сколько памяти занимает карта railway в пересчёте на клетку сетки.
+
+Запуск: python benchmarks/memory.py [размер_сетки ...]
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'railway'))
+
+from simulation import Simulation
+
+DEFAULT_SIZES = (10, 50, 100, 300)
+
+
+def measure(size):
+    """Байты, выделенные при создании карты size x size, и их доля на клетку."""
+    tracemalloc.start()
+    sim = Simulation(size, size)
+    total, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total, total / (size * size), len(sim.tracks)
+
+
+def main(sizes):
+    print("%8s %12s %14s %10s" % ("grid", "tracks", "bytes", "bytes/cell"))
+    for size in sizes:
+        total, per_cell, tracks = measure(size)
+        print("%8s %12d %14d %10.0f" % ("%dx%d" % (size, size), tracks, total, per_cell))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,348 @@
+"""Замеры горячих мест railway на сгенерированных картах.
+
+Запуск: python benchmarks/suite.py [--sizes 10x6 50x50] [--trains 1 10 100] [--out result.jsonl]
+
+Для каждой пары (размер карты, число поездов) строится случайная сеть
+путей, на неё ставятся поезда, и замеряются:
+
+* ticks_per_sec - тиков Simulation.step в секунду;
+* vagon_update_us, train_update_us, add_line_us - среднее время вызова
+  Vagon.update, Train.update и CrossMatrix.add_line внутри тиков
+  (отдельным прогоном с обёртками, они добавляют около микросекунды);
+* get_dir_tracks_ns, is_hovered_ns - отдельные вызовы в цикле;
+* frame_ms_p50/p90/p99 - полная перерисовка кадра во внеэкранную поверхность;
+  frame_middle_ms_*, frame_far_ms_* - то же для всей карты на среднем и дальнем
+  уровне детализации (клетка 28 и 8 пикселей на экране);
+* save_ms, load_ms, snapshot_bytes - двоичный снимок, json_save_ms, json_load_ms - JSON;
+  graph_ok, json_graph_ok - граф путей и маршруты после загрузки те же, что до сохранения;
+* tick_order_ok - Simulation.step, где аварии ищутся после движения всех
+  поездов, даёт то же, что прежний порядок с проверкой после каждого поезда;
+* ff_ticks_per_sec - тиков Simulation.fast_forward в секунду на той же карте,
+  ff_ok - после перемотки состояние и итоги те же, что после step;
+* arc_ok - вагоны на дугах с прогрессом за пределами 0..1 (после разворота)
+  стоят на окружности, как по точной формуле через cos/sin;
+* memory_bytes - память под карту с поездами (tracemalloc).
+
+Каждая строка вывода - JSON одной конфигурации, их удобно сравнивать между коммитами.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'railway'))
+
+from simulation import Simulation
+from track import CurvedTrack
+from train import Train
+from vagon import Vagon
+from crosses import CrossMatrix
+from commands import TOGGLE_TRACK
+
+DEFAULT_SIZES = ((10, 6), (50, 50), (100, 100), (200, 200))
+DEFAULT_TRAINS = (1, 10, 100, 1000)
+MAX_CANVAS = 2000  # размер клетки подбирается так, чтобы холст был не больше
+TRAINS_PER_NODE = 0.25  # больше поездов на карту не ставим, они сразу разобьются
+
+
+def make_layout(grid_size_x, grid_size_y, trains, seed, batched=False):
+    """Случайная сеть путей с поездами на ней."""
+    cell_size = max(8, min(100, MAX_CANVAS // max(grid_size_x, grid_size_y)))
+    sim = Simulation(grid_size_x, grid_size_y, cell_size, batched=batched, seed=seed)
+    rnd = random.Random(seed)
+    # прямые почти везде, дуги пореже, чтобы были стрелки и семафоры
+    for key in list(sim.candidate_keys(0, 0, grid_size_x - 1, grid_size_y - 1)):
+        if rnd.random() < (0.8 if key[2] < 2 else 0.15):
+            sim.execute((TOGGLE_TRACK,) + key)
+
+    nodes = [node for row in sim.nodes for node in row if node.track_count and not node.is_station]
+    # поезда ставятся так же, как их выпускает игра (Simulation.spawn): из пула через add_train
+    for node in rnd.sample(nodes, min(trains, len(nodes))):
+        sim.add_train(sim.pool.take(node, rnd.choice(sim.colors), rnd.randint(2, 5)))
+        sim.tr_started += 1
+    return sim
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def measure_ticks(sim, ticks):
+    start = time.perf_counter()
+    sim.step(ticks)
+    return ticks / (time.perf_counter() - start)
+
+
+def measure_calls(sim, ticks):
+    """Среднее время вызовов горячих функций внутри тиков, мкс."""
+    targets = ((Vagon, 'update'), (Train, 'update'), (CrossMatrix, 'add_line'))
+    totals = {}
+    originals = []
+    for cls, name in targets:
+        original = getattr(cls, name)
+        stat = totals[cls.__name__ + '.' + name] = [0, 0.0]
+
+        def timed(*args, _original=original, _stat=stat):
+            start = time.perf_counter()
+            try:
+                return _original(*args)
+            finally:
+                _stat[0] += 1
+                _stat[1] += time.perf_counter() - start
+        originals.append((cls, name, original))
+        setattr(cls, name, timed)
+    try:
+        sim.step(ticks)
+    finally:
+        for cls, name, original in originals:
+            setattr(cls, name, original)
+    return {name: (total / count * 1e6 if count else None) for name, (count, total) in totals.items()}
+
+
+def measure_lookups(sim, rnd, count=20000):
+    """Время get_dir_tracks и is_hovered на один вызов, нс."""
+    nodes = [node for row in sim.nodes for node in row]
+    picks = [(rnd.choice(nodes), rnd.randrange(4)) for _ in range(count)]
+    start = time.perf_counter()
+    for node, direction in picks:
+        node.get_dir_tracks(direction)
+    dir_tracks_ns = (time.perf_counter() - start) / count * 1e9
+
+    cs = sim.cell_size
+    tracks = list(sim.tracks.values())
+    points = []
+    for _ in range(count):
+        track = rnd.choice(tracks)
+        x, y = track.get_position_on_track(rnd.random(), cs)
+        points.append((track, x + rnd.randint(-3, 3), y + rnd.randint(-3, 3)))
+    start = time.perf_counter()
+    for track, x, y in points:
+        track.is_hovered(x, y, cs)
+    is_hovered_ns = (time.perf_counter() - start) / count * 1e9
+    return dir_tracks_ns, is_hovered_ns
+
+
+def per_train_tick(sim):
+    """Тик в прежнем порядке: аварии ищутся сразу после движения каждого поезда."""
+    sim.spawn()
+    if sim.auto_switch:
+        sim.route_trains()
+    sim.release_retired()
+    fallback = sim.kinematics.step(sim.trains) if sim.kinematics else None
+    sim.crosses.clear()
+    alive = []
+    for train in sim.trains:
+        if fallback is None or train in fallback:
+            if not sim.update_train(train):
+                continue
+            if sim.kinematics:
+                sim.kinematics.refresh(train)
+        sim.crosses.add_train(train)
+        alive.append(train)
+    sim.trains[:] = alive
+    sim.ticks += 1
+
+
+def check_tick_order(size, trains, seed, ticks, batched=False):
+    """Simulation.step совпадает с тиками в прежнем порядке (per_train_tick).
+
+    Столкновение останавливает только поезда, уже прошедшие через карту
+    чекпоинтов, и не освобождает их путей, поэтому искать аварии можно
+    одним проходом после движения всех поездов.
+    """
+    sim, reference = make_layout(*size, trains, seed, batched), make_layout(*size, trains, seed, batched)
+    sim.step(ticks)
+    for _ in range(ticks):
+        per_train_tick(reference)
+    return (sim.state_hash(), sim.get_stats()) == (reference.state_hash(), reference.get_stats())
+
+
+def check_arcs(sim, rnd, count=2000):
+    """Положения на дугах за их концами совпадают с точной формулой окружности."""
+    cs = sim.cell_size
+    arcs = [track for track in sim.tracks.values() if isinstance(track, CurvedTrack)]
+    if not arcs:
+        return None
+    for _ in range(count):
+        track = rnd.choice(arcs)
+        progress = rnd.choice((-1, 1)) * rnd.uniform(0.001, 4) + (rnd.random() < 0.5)
+        if 0 <= progress <= 1:
+            continue
+        center_x, center_y, start_angle, end_angle = track.get_arc(cs)
+        angle = start_angle + (end_angle - start_angle) * progress
+        exact = int(center_x + cs * math.cos(angle)), int(center_y - cs * math.sin(angle))
+        if track.get_position_on_track(progress, cs) != exact:
+            return False
+    return True
+
+
+def measure_fast_forward(size, trains, seed, ticks, batched=False):
+    """Скорость Simulation.fast_forward и совпадение её результата со step."""
+    sim, reference = make_layout(*size, trains, seed, batched), make_layout(*size, trains, seed, batched)
+    start = time.perf_counter()
+    sim.fast_forward(ticks)
+    speed = ticks / (time.perf_counter() - start)
+    reference.step(ticks)
+    return speed, (sim.state_hash(), sim.get_stats()) == (reference.state_hash(), reference.get_stats())
+
+
+def measure_frames(sim, frames, cell=None):
+    """Время полной перерисовки кадра, мс на кадр. cell - размер клетки
+    на экране, вся карта видна в окне; по умолчанию масштаб 1."""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')  # вывод - строки JSON
+    import pygame
+    from spatial import RailwayIndex
+    from layer import TrackLayer
+    from dirty import DirtyRects
+    from camera import Camera, LOD_FAR
+    from render import draw_train, draw_train_pixels, draw_crosses
+
+    world = (sim.grid_size_x * sim.cell_size, sim.grid_size_y * sim.cell_size)
+    scale = cell / sim.cell_size if cell else 1.0
+    size = (int(world[0] * scale), int(world[1] * scale))
+    screen = pygame.Surface(size)
+    camera = Camera(*size, *world)
+    camera.fit()
+    far = camera.lod(sim.cell_size) == LOD_FAR
+    index = RailwayIndex(sim, sim.cell_size)
+    layer = TrackLayer(sim, index, size, camera)
+    layer.set_mode(False)
+    dirty = DirtyRects()
+    times = []
+    for _ in range(frames):
+        sim.step()
+        start = time.perf_counter()
+        layer.full_redraw = True
+        layer.far_key = None  # дальний вид уменьшается заново, как при прокрутке
+        layer.draw(screen, dirty)
+        layer.draw_controls(screen, dirty)
+        if far:
+            draw_train_pixels(screen, sim.trains, sim.cell_size, camera)
+        else:
+            for train in sim.trains:
+                draw_train(screen, train, sim.cell_size, camera)
+        draw_crosses(screen, sim.crosses, camera, show_occupied=not far)
+        times.append((time.perf_counter() - start) * 1000)
+        dirty.rects = []
+        dirty.full = False
+    return times
+
+
+def routing_state(sim):
+    """Рёбра графа и расстояния маршрутов, построенные заново по узлам."""
+    sim.router.rebuild()
+    return sim.graph.edges(), {color: list(dist) for color, dist in sim.router.dist.items()}
+
+
+def measure_save_load(sim):
+    """Время и размер сохранения; после загрузки граф путей и маршруты
+    сверяются с построенными до сохранения (graph_ok, json_graph_ok)."""
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for prefix, ext, save, load in (('', '.rws', sim.save_state, sim.load_state),
+                                        ('json_', '.json', sim.export_json, sim.import_json)):
+            filename = os.path.join(tmp, 'state' + ext)
+            before = routing_state(sim)
+            start = time.perf_counter()
+            save(filename)
+            result[prefix + 'save_ms'] = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            load(filename)
+            result[prefix + 'load_ms'] = (time.perf_counter() - start) * 1000
+            result[('json_bytes' if prefix else 'snapshot_bytes')] = os.path.getsize(filename)
+            result[prefix + 'graph_ok'] = routing_state(sim) == before
+    return result
+
+
+def measure_memory(size, trains, seed):
+    tracemalloc.start()
+    make_layout(*size, trains, seed)
+    total, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return total
+
+
+def run_config(size, trains, args):
+    rnd = random.Random(args.seed)
+    sim = make_layout(*size, trains, args.seed, args.batched)
+    result = {
+        'grid': '%dx%d' % size,
+        'trains': len(sim.trains),
+        'tracks': len(sim.tracks),
+        'cell_size': sim.cell_size,
+        'batched': args.batched,
+        'ticks': args.ticks,
+        'ticks_per_sec': measure_ticks(sim, args.ticks),
+        'trains_alive': len(sim.trains),
+    }
+    calls = measure_calls(make_layout(*size, trains, args.seed), args.ticks)
+    result['vagon_update_us'] = calls['Vagon.update']
+    result['train_update_us'] = calls['Train.update']
+    result['add_line_us'] = calls['CrossMatrix.add_line']
+    result['get_dir_tracks_ns'], result['is_hovered_ns'] = measure_lookups(sim, rnd)
+    result['arc_ok'] = check_arcs(sim, rnd)
+    result['tick_order_ok'] = check_tick_order(size, trains, args.seed, args.ticks, args.batched)
+    result['ff_ticks_per_sec'], result['ff_ok'] = measure_fast_forward(size, trains, args.seed,
+                                                                      args.ticks, args.batched)
+    if args.frames:
+        for name, cell in (('frame', None), ('frame_middle', 28), ('frame_far', 8)):
+            times = measure_frames(sim, args.frames, cell)
+            for p in (50, 90, 99):
+                result['%s_ms_p%d' % (name, p)] = percentile(times, p)
+    result.update(measure_save_load(sim))
+    if not args.no_memory:
+        result['memory_bytes'] = measure_memory(size, trains, args.seed)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def parse_size(text):
+    x, _, y = text.partition('x')
+    return int(x), int(y or x)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры горячих мест railway")
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=DEFAULT_SIZES, help="размеры карт, 50x50")
+    parser.add_argument('--trains', nargs='+', type=int, default=DEFAULT_TRAINS, help="число поездов")
+    parser.add_argument('--ticks', type=int, default=300, help="тиков на замер скорости")
+    parser.add_argument('--frames', type=int, default=30, help="кадров на замер отрисовки, 0 - без неё")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--batched', action='store_true', help="пакетное движение вагонов (numpy)")
+    parser.add_argument('--no-memory', action='store_true', help="не мерить память (это долго)")
+    parser.add_argument('--out', help="дописать результаты в файл вместо stdout")
+    args = parser.parse_args(argv)
+
+    meta = {'commit': git_commit(), 'python': platform.python_version(), 'machine': platform.machine()}
+    out = open(args.out, 'a') if args.out else sys.stdout
+    try:
+        for size in args.sizes:
+            for trains in args.trains:
+                if trains > max(1, size[0] * size[1] * TRAINS_PER_NODE):
+                    continue
+                result = dict(meta, **run_config(size, trains, args))
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -4,10 +4,12 @@ from game.base import BaseMode
 from game.menu import MainMenu
 from game.alert import AlertBox
 from game.battleship_mode import BattleshipMode
+from railway.profiler import FrameProfiler
 
 GAME_NAME = "Моя гра";
 WIN_WIDTH = 800
 WIN_HEIGHT = 800
+TRACE_FILE = "frame_trace.json"  # куда F12 выгружает замеры кадров (ещё .jsonl рядом)
 
 
 class Game:
@@ -36,6 +38,12 @@ class Game:
 
         self.last_mode = '';
 
+        # Перерисовываем экран только когда что-то изменилось
+        self.need_redraw = True
+
+        # F3 - HUD с временем фаз кадра, F12 - выгрузка trace
+        self.profiler = FrameProfiler()
+
         # Текущий режим игры
         self.switch_mode('start')
 
@@ -54,6 +62,7 @@ class Game:
             return
 
         self.last_mode = mode
+        self.need_redraw = True
 
     def toggle_fullscreen(self):
         """Переключение между полноэкранным и оконным режимами."""
@@ -62,6 +71,7 @@ class Game:
         else:
             self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
         self.is_fullscreen = not self.is_fullscreen
+        self.need_redraw = True
 
     def draw_status_bar(self):
         """Отображает строку состояния с заголовком и кнопками."""
@@ -109,52 +119,78 @@ class Game:
 
     def run(self):
         """Основной игровой цикл."""
+        phase = self.profiler.phase
         while self.running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-
-                if self.alert:
-                    if self.alert.handle_event(event):
-                        self.alert = None  # Закрытие алерта при клике
-                else:
-
-                    if event.type == pygame.MOUSEBUTTONDOWN:
-                        mouse_pos = pygame.mouse.get_pos()
+            self.profiler.begin_frame()
+            with phase('events'):
+                self.handle_events()
 
-                        # Проверка кликов по кнопкам
-                        exit_rect, toggle_rect, reset_rect = self.draw_status_bar()
-                        if exit_rect.collidepoint(mouse_pos):
-                            self.running = False
-                        elif toggle_rect.collidepoint(mouse_pos):
-                            self.toggle_fullscreen()
-                        elif reset_rect.collidepoint(mouse_pos):
-                            if self.last_mode:
-                                self.switch_mode(self.last_mode)
+            # обновление режима, True - режим что-то поменял сам, без событий
+            with phase('update'):
+                if not self.alert:
+                    if self.current_mode.update():
+                        self.need_redraw = True
 
-                    # Передача событий текущему режиму
-                    result = self.current_mode.handle_event(event)
-                    if result:
-                        self.switch_mode(result)
+            # HUD меняется каждый кадр
+            if self.need_redraw or self.profiler.visible:
+                self.need_redraw = False
 
-            # Обновление экрана
-            self.screen.fill(self.bg_color)
+                with phase('draw'):
+                    # Обновление экрана
+                    self.screen.fill(self.bg_color)
 
+                    # Отрисовка строки состояния
+                    self.draw_status_bar()
 
-            # Отрисовка строки состояния
-            self.draw_status_bar()
+                    # Отрисовка текущего режима
+                    self.current_mode.draw()
 
-            # обновление режима
-            if not self.alert:
-                self.current_mode.update()
+                    if self.alert:
+                        self.alert.show()
 
-            # Отрисовка текущего режима
-            self.current_mode.draw()
+                    if self.profiler.visible:
+                        self.profiler.draw(self.screen)
 
-            if self.alert:
-                self.alert.show()
+                with phase('flip'):
+                    pygame.display.flip()
 
-            pygame.display.flip()
+            self.profiler.end_frame()
             self.clock.tick(60)
 
-        pygame.quit()
\ No newline at end of file
+        pygame.quit()
+
+    def handle_events(self):
+        """Обрабатывает события окна и передаёт их режиму."""
+        for event in pygame.event.get():
+            # любое событие может поменять картинку (наведение, клик, клавиша)
+            self.need_redraw = True
+            if event.type == pygame.QUIT:
+                self.running = False
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.profiler.toggle()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F12:
+                self.profiler.dump(TRACE_FILE)
+                self.profiler.dump(TRACE_FILE + "l")
+            elif self.alert:
+                if self.alert.handle_event(event):
+                    self.alert = None  # Закрытие алерта при клике
+            else:
+
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    mouse_pos = pygame.mouse.get_pos()
+
+                    # Проверка кликов по кнопкам
+                    exit_rect, toggle_rect, reset_rect = self.draw_status_bar()
+                    if exit_rect.collidepoint(mouse_pos):
+                        self.running = False
+                    elif toggle_rect.collidepoint(mouse_pos):
+                        self.toggle_fullscreen()
+                    elif reset_rect.collidepoint(mouse_pos):
+                        if self.last_mode:
+                            self.switch_mode(self.last_mode)
+
+                # Передача событий текущему режиму
+                result = self.current_mode.handle_event(event)
+                if result:
+                    self.switch_mode(result)
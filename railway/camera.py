@@ -0,0 +1,114 @@
+import pygame
+
+ZOOM_STEP = 1.25  # во сколько раз меняется масштаб за щелчок колеса
+MAX_SCALE = 4.0  # сильнее не увеличиваем
+PAN_STEP = 0.25  # доля окна, на которую сдвигают стрелки клавиатуры
+
+# уровни детализации, выбираются по размеру клетки на экране (Camera.lod)
+LOD_NEAR = 0  # всё: стрелки, семафоры, чекпоинты, вагоны кружками
+LOD_MIDDLE = 1  # без стрелок, семафоров и пустых чекпоинтов
+LOD_FAR = 2  # вместо путей - уменьшенная миникарта, поезда точками
+NEAR_CELL = 40  # клетка от стольких пикселей - LOD_NEAR
+FAR_CELL = 16  # клетка меньше стольких пикселей - LOD_FAR
+
+
+class Camera:
+    """Видимая часть карты: масштаб и сдвиг окна по холсту.
+
+    Модель, индексы и кэши геометрии живут в координатах холста при
+    sim.cell_size, камеру знает только отрисовка: точка холста (x, y)
+    на экране - (int(x * scale) - ox, int(y * scale) - oy). Сдвиг целый,
+    поэтому при прокрутке картинка сдвигается ровно на столько пикселей,
+    и слой путей можно не перерисовывать, а прокрутить (TrackLayer.draw).
+    Всё, что рисуется, отбирается по world_rect через индексы, поэтому
+    время кадра зависит от видимой части, а не от размера карты.
+    """
+
+    def __init__(self, width, height, world_width, world_height):
+        self.width = width  # размер окна
+        self.height = height
+        self.world_width = world_width  # размер холста карты
+        self.world_height = world_height
+        # мельче, чем вся карта в окне, не уменьшаем
+        self.min_scale = min(1.0, width / world_width, height / world_height)
+        self.scale = 1.0
+        self.ox = 0  # сдвиг окна в экранных пикселях
+        self.oy = 0
+        self.clamp()
+
+    def key(self):
+        """Всё, от чего зависит картинка на экране."""
+        return self.scale, self.ox, self.oy
+
+    def lod(self, cell_size):
+        """Уровень детализации для клетки cell_size холста."""
+        cell = cell_size * self.scale
+        if cell >= NEAR_CELL:
+            return LOD_NEAR
+        if cell >= FAR_CELL:
+            return LOD_MIDDLE
+        return LOD_FAR
+
+    def to_screen(self, x, y):
+        scale = self.scale
+        return int(x * scale) - self.ox, int(y * scale) - self.oy
+
+    def to_world(self, x, y):
+        """Точка холста под точкой экрана."""
+        return (x + self.ox) / self.scale, (y + self.oy) / self.scale
+
+    def size(self, value, minimum=1):
+        """Длина value холста на экране, не меньше minimum пикселей."""
+        return max(minimum, int(value * self.scale))
+
+    def world_rect(self, rect=None):
+        """Прямоугольник холста (x_min, y_min, x_max, y_max), видимый в rect экрана."""
+        if rect is None:
+            rect = (0, 0, self.width, self.height)
+        left, top, width, height = rect
+        x_min, y_min = self.to_world(left, top)
+        x_max, y_max = self.to_world(left + width, top + height)
+        return x_min, y_min, x_max, y_max
+
+    def screen_rect(self, x_min, y_min, x_max, y_max):
+        """Прямоугольник экрана, закрывающий прямоугольник холста."""
+        left, top = self.to_screen(x_min, y_min)
+        right, bottom = self.to_screen(x_max, y_max)
+        return pygame.Rect(left, top, right - left + 1, bottom - top + 1)
+
+    def is_visible(self, x, y, margin=0):
+        """Попадает ли точка холста в окно (с запасом margin экранных пикселей)."""
+        sx, sy = self.to_screen(x, y)
+        return -margin <= sx < self.width + margin and -margin <= sy < self.height + margin
+
+    def zoom_at(self, factor, x, y):
+        """Меняет масштаб, точка экрана (x, y) остаётся над той же точкой холста."""
+        world_x, world_y = self.to_world(x, y)
+        self.scale = min(MAX_SCALE, max(self.min_scale, self.scale * factor))
+        if abs(self.scale - 1) < 1e-9:
+            self.scale = 1.0  # к исходному масштабу возвращаемся точно
+        self.ox = int(world_x * self.scale) - x
+        self.oy = int(world_y * self.scale) - y
+        self.clamp()
+
+    def pan(self, dx, dy):
+        """Сдвигает карту на (dx, dy) экранных пикселей."""
+        self.ox -= int(dx)
+        self.oy -= int(dy)
+        self.clamp()
+
+    def fit(self):
+        """Вся карта в окне."""
+        self.scale = self.min_scale
+        self.clamp()
+
+    def clamp(self):
+        """Не даёт увести карту из окна, меньшую окна карту ставит по центру."""
+        self.ox = self.clamp_axis(self.ox, self.world_width, self.width)
+        self.oy = self.clamp_axis(self.oy, self.world_height, self.height)
+
+    def clamp_axis(self, offset, world, window):
+        size = int(world * self.scale)
+        if size <= window:
+            return -((window - size) // 2)
+        return min(max(offset, 0), size - window)
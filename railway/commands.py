@@ -0,0 +1,67 @@
+"""Команды игрока и запись сеанса.
+
+Все действия игрока, меняющие симуляцию, проходят через
+Simulation.execute и запоминаются с номером тика. Вместе с зерном
+генератора этого достаточно, чтобы повторить сеанс без окна, см. replay.py.
+Команда - кортеж (код, a, b, c) из целых чисел.
+"""
+import struct
+
+TOGGLE_TRACK = 1  # ключ пути: x, y, вид
+SWITCH = 2  # узел x, y и направление стрелки
+SEMAPHORE = 3  # узел x, y и направление семафора
+SPAWN_DRAISINE = 4  # станция x, y
+AUTO_SWITCH = 5  # 1 - стрелки перед поездами ставит Router, 0 - только игрок
+
+MAGIC = b'RWRC'
+VERSION = 1
+
+# магия, версия, зерно, размер сетки, размер клетки, тиков в сеансе, хэш состояния в конце
+HEADER = struct.Struct('<4sHxxQIIIQ16s')
+# тик, код команды, аргументы
+RECORD = struct.Struct('<QBiii')
+
+
+class SessionError(ValueError):
+    """Файл не запись сеанса."""
+
+
+class Session:
+    """Записанный сеанс: с какой карты начали, что делал игрок и чем кончилось.
+
+    Сеанс пишется с новой карты, загрузка сохранения в середине сеанса
+    в запись не попадает.
+    """
+    __slots__ = ('seed', 'grid_size_x', 'grid_size_y', 'cell_size', 'commands', 'ticks', 'state_hash')
+
+    def __init__(self, seed, grid_size_x, grid_size_y, cell_size, commands=(), ticks=0, state_hash=bytes(16)):
+        self.seed = seed
+        self.grid_size_x = grid_size_x
+        self.grid_size_y = grid_size_y
+        self.cell_size = cell_size
+        self.commands = list(commands)  # (тик, код, a, b, c)
+        self.ticks = ticks
+        self.state_hash = state_hash
+
+    @classmethod
+    def from_simulation(cls, sim):
+        return cls(sim.seed, sim.grid_size_x, sim.grid_size_y, sim.cell_size,
+                   sim.commands, sim.ticks, sim.state_hash())
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.seed, self.grid_size_x, self.grid_size_y,
+                                self.cell_size, self.ticks, self.state_hash))
+            f.write(b''.join(RECORD.pack(*record) for record in self.commands))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        if len(data) < HEADER.size or (len(data) - HEADER.size) % RECORD.size:
+            raise SessionError("%s: неверный размер записи" % filename)
+        magic, version, seed, grid_size_x, grid_size_y, cell_size, ticks, state_hash = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise SessionError("%s: не запись сеанса версии %d" % (filename, VERSION))
+        commands = list(RECORD.iter_unpack(data[HEADER.size:]))
+        return cls(seed, grid_size_x, grid_size_y, cell_size, commands, ticks, state_hash)
@@ -1,7 +1,10 @@
-import pygame
-from node import Node
+import math
+from bisect import bisect_left, bisect_right
+from geometry import TABLES, SEGMENTS
+from vagon import vagon_step
 
 T_CRAFT = 3
+START = float('-inf')  # время чекпоинтов, занятых поездом с начала шага
 
 class Crosses:
     def __init__(self, nodes, cell_size):
@@ -10,6 +13,10 @@ class Crosses:
         self.crashes = 0
         self.last_point = None
         self.last_train = None
+        self.cell_size = cell_size
+        self.swept = False  # искать столкновения по пройденному пути, см. sweep_trains
+        self.on_track = {}  # ключ пути -> чекпоинты на нём, см. track_points
+        self.tolerance = max(2, cell_size / 40)  # чекпоинты дуг стоят на ней с округлением
 
         # чекпоинты по узлам
         mat = CrossMatrix()
@@ -63,14 +70,13 @@ class Crosses:
 
         self.matrixes.append(mat)
 
-
-
-
+        for mat in self.matrixes:
+            mat.allocate()
 
     # обнулить карту занятости
     def clear(self):
         for matrix in self.matrixes:
-            matrix.bisy = {}
+            matrix.clear()
 
         self.crashes = 0
         self.last_point = None
@@ -87,48 +93,210 @@ class Crosses:
                 self.crashes += cr
         self.last_point = (x,y)
 
-    def draw(self, screen):
+    def add_train(self, train):
+        """Прогоняет вагоны поезда через карту чекпоинтов, ловит столкновения.
+
+        Вызывается на каждом тике симуляции после Train.update_positions,
+        отрезки между соседними вагонами занимают чекпоинты, которые они пересекают.
+        """
+        self.new_train(train)
+        for vagon in train.vagons:
+            if vagon.pos:
+                self.add_point(*vagon.pos)
+
+    def add_trains(self, trains):
+        """Ищет столкновения поездов, прошедших тик или шаг."""
+        if self.swept:
+            self.sweep_trains(trains)
+        else:
+            for train in trains:
+                self.add_train(train)
+
+    def restart(self, train):
+        """Забывает пройденный поездом путь, следующий шаг считается от текущего места.
+
+        Нужно, когда поезд не проходил через карту чекпоинтов несколько тиков
+        (Simulation.fast_forward), иначе весь путь за это время попадёт в один шаг.
+        """
+        for vagon in train.vagons:
+            vagon.trail = None
+
+    def track_points(self, track):
+        """Чекпоинты на пути [(прогресс от node1, матрица, i, j)] по возрастанию прогресса."""
+        points = self.on_track.get(track.key)
+        if points is None:
+            points = self.on_track[track.key] = self.find_track_points(track)
+        return points
+
+    def find_track_points(self, track):
+        g = track.get_geometry(self.cell_size)
+        table_xs, table_ys = TABLES[g.table]
+        line = [(g.x1 + x, g.y1 + y) for x, y in zip(table_xs, table_ys)]
+        tolerance = self.tolerance
+        points = []
         for matrix in self.matrixes:
-            matrix.draw(screen)
+            xs, ys = matrix.xs, matrix.ys
+            for i in range(bisect_left(xs, g.x_min - tolerance), bisect_right(xs, g.x_max + tolerance)):
+                for j in range(bisect_left(ys, g.y_min - tolerance), bisect_right(ys, g.y_max + tolerance)):
+                    distance, progress = closest_on_line(line, xs[i], ys[j])
+                    if distance <= tolerance:
+                        points.append((progress, matrix, i, j))
+        points.sort(key=lambda point: point[0])
+        return points
+
+    def sweep_trains(self, trains):
+        """Столкновения по всему пути вагонов за шаг, сколько бы тиков он ни длился.
+
+        Каждый вагон проходит через все чекпоинты между своими точками на
+        прошлом и на этом шаге (Vagon.trail), через узлы и по дугам; время
+        прохода считается в тиках до конца шага. Чекпоинты между вагонами
+        поезд занимает с начала шага. Отметки всех поездов разбираются по
+        времени: поезд, разбившийся раньше, дальше чекпоинты не занимает.
+        """
+        events = []
+        for train in trains:
+            for time, matrix, i, j in self.train_events(train).values():
+                events.append((time, len(events), train, matrix, i, j))
+        events.sort(key=lambda event: event[:2])
+
+        stopped = {train: START for train in trains if train.is_crached}
+        for time, _, train, matrix, i, j in events:
+            if stopped.get(train, time) < time:
+                continue
+            owner = matrix.owner(i, j)
+            cr = matrix.claim(train, i, j)
+            if cr:
+                self.crashes += cr
+                stopped.setdefault(train, time)
+                if cr == 2:
+                    stopped.setdefault(owner, time)
+
+    def train_events(self, train):
+        """Чекпоинты поезда за шаг: {(матрица, i, j): (время, матрица, i, j)}."""
+        events = {}
+        placed = []  # (путь, прогресс от node1) активных вагонов по порядку
+        for vagon in train.vagons:
+            track = vagon.current_track
+            if not vagon.is_active or not track:
+                vagon.trail = None
+                continue
+            progress = vagon.track_progress()
+            placed.append((track, progress))
+            trail = vagon.trail
+            if trail is None:
+                vagon.trail = [(track, progress)]
+                continue
+            trail.append((track, progress))
+            # от конца шага назад: время прохода чекпоинта в тиках до конца шага
+            time = 0.0
+            for k in range(len(trail) - 1, 0, -1):
+                track, end = trail[k]
+                other, start = trail[k - 1]
+                if other is not track:
+                    continue  # переезд через узел, времени не занимает
+                step = vagon_step(track)
+                for point, matrix, i, j in self.points_between(track, start, end):
+                    key = (matrix, i, j)
+                    at = time - abs(end - point) / step
+                    if key not in events or at < events[key][0]:
+                        events[key] = (at, matrix, i, j)
+                time -= abs(end - start) / step
+            del trail[:-1]
+
+        # между вагонами
+        for (track, progress), (other, other_progress) in zip(placed, placed[1:]):
+            if track is other:
+                spans = ((track, progress, other_progress),)
+            else:
+                node = track.node1 if track.node1 in (other.node1, other.node2) else track.node2
+                if node not in (other.node1, other.node2):
+                    continue
+                spans = ((track, progress, 0.0 if track.node1 == node else 1.0),
+                         (other, other_progress, 0.0 if other.node1 == node else 1.0))
+            for span_track, start, end in spans:
+                for _, matrix, i, j in self.points_between(span_track, start, end):
+                    events.setdefault((matrix, i, j), (START, matrix, i, j))
+        return events
+
+    def points_between(self, track, start, end):
+        """Чекпоинты пути с прогрессом между start и end включительно."""
+        low, high = min(start, end), max(start, end)
+        return [point for point in self.track_points(track) if low <= point[0] <= high]
+
+
+def closest_on_line(line, x, y):
+    """Расстояние от точки до ломаной таблицы положений и прогресс ближайшей точки."""
+    best = None
+    for k in range(len(line) - 1):
+        x1, y1 = line[k]
+        x2, y2 = line[k + 1]
+        dx, dy = x2 - x1, y2 - y1
+        length = dx * dx + dy * dy
+        s = ((x - x1) * dx + (y - y1) * dy) / length if length else 0.0
+        s = min(1.0, max(0.0, s))
+        distance = math.hypot(x1 + dx * s - x, y1 + dy * s - y)
+        if best is None or distance < best[0]:
+            best = (distance, (k + s) / SEGMENTS)
+    return best
 
 
 class CrossMatrix:
+    """Чекпоинты на пересечениях xs и ys, занятость за текущий тик.
+
+    Занятость хранится по номеру чекпоинта i * len(ys) + j: в stamps номер
+    тика (поколения), на котором чекпоинт заняли, в owners поезд. Очистка
+    только увеличивает поколение, старые отметки становятся недействительными
+    сами, а список occupied помнит занятые на этом тике точки для отрисовки.
+    Так очистка и отрисовка стоят столько, сколько точек заняли поезда.
+    """
     def __init__(self):
         self.xs = []
         self.ys = []
-        self.bisy = {} # по по ключу (x,y) храним поезд
+        self.generation = 1
+        self.stamps = [] # по номеру чекпоинта поколение, когда его заняли
+        self.owners = [] # по номеру чекпоинта занявший поезд
+        self.occupied = [] # (x, y, поезд) занятые в текущем поколении
         self.crashes = {} # по по ключу (x,y) храним место аварии
 
-    def draw(self, screen):
-        for x in self.xs:
-            for y in self.ys:
-                if (x,y) in self.crashes:
-                    color = (80, 10, 10);
-                    pygame.draw.circle(screen, color, (x, y), 12)
-                else:
-                    color = (255,255,255);
-                    # color = (10,10,10);
-                    if (x,y) in self.bisy:
-                        color = self.bisy[(x,y)].color
-                    pygame.draw.circle(screen, color, (x, y), 3)
-
-    # в масива xs или ys найти значение между v1 и v2
+    def allocate(self):
+        """Заводит отметки под все чекпоинты, после заполнения xs и ys."""
+        self.stamps = [0] * (len(self.xs) * len(self.ys))
+        self.owners = [None] * len(self.stamps)
+
+    def clear(self):
+        self.generation += 1
+        self.occupied.clear()
+
+    # в масива xs или ys найти номер значения между v1 и v2
+    # массивы отсортированы, поэтому ищем бинарным поиском первое подходящее
     def find_by_dim(self,arr, v1, v2):
         v1, v2 = min(v1,v2),max(v1,v2)
-        for v in arr:
-            if v1-0.2 < v < v2+0.2:
-                return v
+        i = bisect_right(arr, v1-0.2)
+        if i < len(arr) and arr[i] < v2+0.2:
+            return i
         return None
 
     def add_line(self, train, point1, point2):
         x1, y1 = point1
         x2, y2 = point2
 
-        x = self.find_by_dim(self.xs,x1,x2)
-        y = self.find_by_dim(self.ys,y1,y2)
-
-        if not x or not y:
+        i = self.find_by_dim(self.xs,x1,x2)
+        if i is None:
             return 0
+        j = self.find_by_dim(self.ys,y1,y2)
+        if j is None:
+            return 0
+        return self.claim(train, i, j)
+
+    def owner(self, i, j):
+        """Поезд, занявший чекпоинт в текущем поколении, или None."""
+        cell = i * len(self.ys) + j
+        return self.owners[cell] if self.stamps[cell] == self.generation else None
+
+    def claim(self, train, i, j):
+        """Поезд проходит через чекпоинт, возвращает число разбившихся поездов."""
+        x = self.xs[i]
+        y = self.ys[j]
 
         key = (x,y)
         if key in self.crashes:
@@ -140,8 +308,9 @@ class CrossMatrix:
                 train.do_crash()
                 return 1
 
-        if key in self.bisy:
-            old_train = self.bisy[key]
+        cell = i * len(self.ys) + j
+        if self.stamps[cell] == self.generation:
+            old_train = self.owners[cell]
 
             if train != old_train:
                 # столкнулось 2 поезда
@@ -150,8 +319,8 @@ class CrossMatrix:
                 self.crashes[(x,y)] = 1
                 return 2
         else:
-            self.bisy[key] = train
+            self.stamps[cell] = self.generation
+            self.owners[cell] = train
+            self.occupied.append((x, y, train))
 
         return 0
-
-
@@ -0,0 +1,19 @@
+# Направления выезда из узла кодируются числами 0..3 вместо кортежей (dx, dy):
+# такие ключи не надо создавать и хешировать, а состояние узла по
+# направлениям помещается в маленькие массивы и битовые маски.
+LEFT, RIGHT, UP, DOWN = 0, 1, 2, 3
+DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))  # код -> (dx, dy)
+DIR_CODES = {d: code for code, d in enumerate(DIRECTIONS)}  # (dx, dy) -> код
+ALL_DIRS = (LEFT, RIGHT, UP, DOWN)
+
+# число единичных битов в маске направлений
+BIT_COUNT = tuple(bin(mask).count('1') for mask in range(16))
+
+
+def opposite(direction):
+    """Противоположное направление: 0<->1, 2<->3."""
+    return direction ^ 1
+
+
+def dir_code(dx, dy):
+    return DIR_CODES[(dx, dy)]
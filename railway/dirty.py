@@ -0,0 +1,32 @@
+import pygame
+
+
+class DirtyRects:
+    """Прямоугольники экрана, изменённые за кадр.
+
+    Вместо flip всего окна на дисплей выводятся только они.
+    """
+
+    def __init__(self):
+        self.rects = []
+        self.full = False  # изменился весь экран
+
+    def add(self, rect):
+        if rect and not self.full:
+            self.rects.append(pygame.Rect(rect))
+
+    def add_full(self):
+        self.full = True
+        self.rects = []
+
+    def is_empty(self):
+        return not self.full and not self.rects
+
+    def update(self):
+        """Выводит изменения на дисплей и начинает новый кадр."""
+        if self.full:
+            pygame.display.flip()
+        elif self.rects:
+            pygame.display.update(self.rects)
+        self.rects = []
+        self.full = False
@@ -0,0 +1,311 @@
+"""Перемотка симуляции по событиям вместо тиков.
+
+Между узлами вагон едет равномерно: каждый тик прогресс растёт на один и
+тот же шаг. Поэтому поезд достаточно считать на тиках, когда у него что-то
+происходит: вагон доезжает до узла или отъезжает на VAGON_LEN и выпускает
+следующий вагон. Тики этих событий лежат в очереди с приоритетом, часы
+перескакивают от события к событию, на пропущенных тиках тратится только
+бросок на выпуск нового поезда (выпал - это тоже событие).
+
+Столкнуться могут только поезда, чьи пути до ближайшего события
+пересекаются друг с другом или с местом аварии, такие поезда считаются
+каждый тик и проходят через карту чекпоинтов. Последний тик перемотки
+обычный (Simulation.tick), после него состояние совпадает с
+Simulation.step тик в тик.
+
+Выигрыш есть, пока на посчитанных тиках обновляется малая часть поездов.
+Поезд с событием стоит примерно двух обычных обновлений (прогресс вперёд
+считается заново). Если поезда всё время рядом друг с другом или мечутся
+на коротких участках, разворачиваясь у тупиков, обновлять приходится
+почти всех и почти каждый тик. Поэтому перемотка считает обновлённые
+поезда за окно WINDOW тиков и, если их больше BUSY от того, что обновил
+бы Simulation.step, идёт обычными тиками по PLAIN за раз. На таких
+картах она не быстрее step.
+"""
+import heapq
+try:
+    import numpy as np
+except ImportError:  # без numpy прогресс и броски считаются в цикле
+    np = None
+from vagon import VAGON_LEN, vagon_step
+
+HORIZON = 150  # за столько тиков любой вагон доезжает до узла (на дуге ~143)
+NEVER = float('inf')
+WINDOW = 100  # за столько тиков решается, окупается ли перемотка
+BUSY = 0.5  # обновление с событием стоит двух обычных: больше половины обновлений step - step быстрее
+PLAIN = 1000  # тогда столько тиков идут обычными, потом пробуем перематывать снова
+
+
+class FastForward:
+    """Перемотка одной симуляции, см. Simulation.fast_forward."""
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.plans = {}  # поезд -> (тик начала, [(вагон, прогресс по тикам)], тик события)
+        self.queue = []  # (тик события, номер, поезд, план)
+        self.counter = 0
+        self.boxes = {}  # поезд -> где его вагоны могут быть до события
+        self.near = set()  # поезда, которые считаются каждый тик
+        self.margin = 2  # округление координат и допуск CrossMatrix.find_by_dim
+
+    def run(self, ticks):
+        sim = self.sim
+        if ticks <= 0:
+            return
+        end = sim.ticks + ticks - 1
+        self.start()
+        window = sim.ticks  # с какого тика считаем, окупается ли перемотка
+        updated = 0
+        while sim.ticks < end:
+            self.skip(end)
+            if sim.ticks < end:
+                updated += self.process() + 1  # сам посчитанный тик стоит примерно как поезд
+            if sim.ticks - window >= WINDOW:
+                if updated > BUSY * len(sim.trains) * (sim.ticks - window):
+                    # поезда всё время рядом или разворачиваются, обычные тики дешевле
+                    self.finish()
+                    sim.step(min(PLAIN, end + 1 - sim.ticks))
+                    if sim.ticks > end:
+                        return  # последний тик тоже прошёл обычным
+                    self.start()
+                window = sim.ticks
+                updated = 0
+        self.finish()
+        sim.tick()
+
+    def start(self):
+        """Планирует все поезда заново, после обычных тиков состояние уже другое."""
+        self.plans.clear()
+        self.queue = []
+        self.boxes.clear()
+        for train in self.sim.trains:
+            self.schedule(train)
+        self.update_near()
+
+    def schedule(self, train):
+        """Считает прогресс вагонов поезда вперёд и находит тик его события."""
+        sim = self.sim
+        base = sim.ticks
+        movers = [vagon for vagon in train.vagons if vagon.is_active and vagon.current_track]
+        if not movers:
+            self.plans[train] = (base, [], NEVER)
+            return
+        thresholds = [VAGON_LEN if vagon.is_pre_tail else 1 for vagon in movers]
+        steps = [vagon_step(vagon.current_track) for vagon in movers]
+        if any(vagon.progress + step >= threshold
+               for vagon, step, threshold in zip(movers, steps, thresholds)):
+            # событие на следующем же тике, вперёд считать незачем
+            plan = (base, [(vagon, [vagon.progress]) for vagon in movers], base)
+        elif np is not None:
+            table = np.empty((len(movers), HORIZON + 1))
+            table[:, 0] = [vagon.progress for vagon in movers]
+            table[:, 1:] = np.array(steps)[:, None]
+            # accumulate складывает по порядку, как прибавление шага в каждом тике
+            table = np.add.accumulate(table, axis=1)
+            hits = table[:, 1:] >= np.array(thresholds)[:, None]
+            first = np.where(hits.any(axis=1), hits.argmax(axis=1), HORIZON - 1)
+            due = base + int(first.min())
+            plan = (base, list(zip(movers, table.tolist())), due)
+        else:
+            rows = []
+            due = base + HORIZON - 1
+            for vagon, step, threshold in zip(movers, steps, thresholds):
+                progress = vagon.progress
+                row = [progress]
+                for j in range(HORIZON):
+                    progress += step
+                    row.append(progress)
+                    if progress >= threshold:
+                        due = min(due, base + j)
+                rows.append(row)
+            plan = (base, list(zip(movers, rows)), due)
+        self.plans[train] = plan
+        self.counter += 1
+        heapq.heappush(self.queue, (plan[2], self.counter, train, plan))
+
+    def materialize(self, train, tick):
+        """Выставляет вагонам поезда прогресс на начало тика tick."""
+        plan = self.plans.pop(train, None)
+        if plan:
+            base, rows, _ = plan
+            for vagon, row in rows:
+                vagon.progress = row[tick - base]
+
+    def next_event(self):
+        queue = self.queue
+        while queue:
+            due, _, train, plan = queue[0]
+            if self.plans.get(train) is plan:
+                return due
+            heapq.heappop(queue)
+        return NEVER
+
+    def skip(self, end):
+        """Проматывает тики без событий, тратя на них броски выпуска поездов."""
+        sim = self.sim
+        if self.near or sim.retired or not sim.trains:
+            return  # этот тик считаем
+        quiet = min(self.next_event(), end) - sim.ticks
+        if quiet > 0:
+            sim.ticks += self.spend_rolls(quiet, sim.spawn_chance())
+
+    def spend_rolls(self, count, chance):
+        """Бросает выпуск поезда на count тиков вперёд, до первого выпавшего.
+
+        Возвращает, сколько тиков прошло без выпуска. Выпавший бросок
+        не тратится, его сделает Simulation.spawn на своём тике.
+        """
+        rnd = self.sim.random
+        state = rnd.getstate()
+        if np is not None:
+            # random() собирает число из двух 32-битных слов генератора, как здесь
+            words = np.frombuffer(rnd.getrandbits(64 * count).to_bytes(8 * count, 'little'), dtype='<u4')
+            rolls = ((words[0::2] >> 5) * 67108864.0 + (words[1::2] >> 6)) * (1.0 / 9007199254740992.0)
+            hits = np.flatnonzero(rolls < chance)
+            if not hits.size:
+                return count
+            spent = int(hits[0])
+        else:
+            for spent in range(count):
+                if rnd.random() < chance:
+                    break
+            else:
+                return count
+        rnd.setstate(state)
+        if spent:
+            rnd.getrandbits(64 * spent)
+        return spent
+
+    def process(self):
+        """Считает тик: выпуск поезда, поезда с событием и поезда рядом с другими.
+
+        Возвращает, сколько поездов пришлось обновить.
+        """
+        sim = self.sim
+        tick = sim.ticks
+        due = set(self.near)
+        while self.next_event() == tick:
+            due.add(heapq.heappop(self.queue)[2])
+
+        count = len(sim.trains)
+        sim.spawn()
+        due.update(sim.trains[count:])
+
+        if sim.auto_switch:
+            sim.route_trains()
+        sim.release_retired()
+        alive = []
+        for train in sim.trains:
+            if train in due:
+                self.materialize(train, tick)
+                if not sim.update_train(train):
+                    continue
+            alive.append(train)
+        sim.trains[:] = alive
+
+        # после события вагоны могут оказаться где угодно, поэтому соседей
+        # ищем по новым положениям, до поиска столкновений на этом тике
+        sim.ticks += 1
+        for train in due:
+            self.boxes.pop(train, None)
+            self.plans.pop(train, None)
+        for train in alive:
+            if train in due:
+                self.schedule(train)
+        previous = self.near
+        self.update_near()
+
+        # соседей, которых не считали на этом тике, догоняем до него
+        for train in self.near:
+            if train in self.plans:
+                if train not in due:
+                    self.materialize(train, sim.ticks)
+                    train.update_positions(sim.cell_size)
+                    train.update_positions(sim.cell_size)
+                self.plans.pop(train, None)
+                self.boxes.pop(train, None)
+
+        # остальные поезда ни с кем не пересекаются, на карте их можно не отмечать
+        sim.crosses.clear()
+        for train in self.near - previous:
+            sim.crosses.restart(train)
+        sim.crosses.add_trains([train for train in sim.trains if train in self.near])
+        return len(due)
+
+    def box(self, train):
+        """Где могут оказаться вагоны поезда до его события, прямоугольник с запасом.
+
+        Вагоны с прогрессом за пределами 0..1 рисуются на продолжении пути,
+        их крайние положения добавляются к прямоугольнику пути.
+        """
+        box = self.boxes.get(train)
+        if box is None:
+            cell_size = self.sim.cell_size
+            x_min = y_min = NEVER
+            x_max = y_max = -NEVER
+            plan = self.plans.get(train)
+            if plan:
+                base, rows, due = plan
+                last = due - base + 1
+                for vagon, row in rows:
+                    track = vagon.current_track
+                    geometry = track.get_geometry(cell_size)
+                    x_min = min(x_min, geometry.x_min)
+                    y_min = min(y_min, geometry.y_min)
+                    x_max = max(x_max, geometry.x_max)
+                    y_max = max(y_max, geometry.y_max)
+                    span = row[:last]
+                    low, high = min(span), max(span)
+                    if low < 0 or high > 1:
+                        forward = track.node1 == vagon.start_node  # как в Vagon.get_position
+                        for progress in (low, high):
+                            x, y = track.get_position_on_track(progress if forward else 1 - progress, cell_size)
+                            x_min, y_min = min(x_min, x), min(y_min, y)
+                            x_max, y_max = max(x_max, x), max(y_max, y)
+            m = self.margin
+            box = self.boxes[train] = (x_min - m, y_min - m, x_max + m, y_max + m)
+        return box
+
+    def update_near(self):
+        """Находит поезда, которые могут столкнуться до своего события."""
+        sim = self.sim
+        near = set()
+        items = []
+        for train in sim.trains:
+            if not train.is_active:
+                near.add(train)  # разбился, уберём на следующем тике
+            else:
+                items.append((self.box(train), train))
+        for matrix in sim.crosses.matrixes:
+            for x, y in matrix.crashes:
+                items.append(((x, y, x, y), None))
+        items.sort(key=lambda item: item[0][0])
+
+        # заметание по x: сравниваем только с тем, что ещё не кончилось левее
+        opened = []
+        for box, train in items:
+            x_min, y_min, x_max, y_max = box
+            opened = [item for item in opened if item[0][2] >= x_min]
+            for other_box, other in opened:
+                if other_box[1] <= y_max and y_min <= other_box[3] and (train or other):
+                    if train:
+                        near.add(train)
+                    if other:
+                        near.add(other)
+            opened.append((box, train))
+        self.near = near
+
+    def finish(self):
+        """Выставляет всем поездам прогресс и координаты на текущий тик."""
+        sim = self.sim
+        for train in list(self.plans):
+            if train in sim.trains:
+                self.materialize(train, sim.ticks)
+                train.update_positions(sim.cell_size)
+                train.update_positions(sim.cell_size)
+        self.plans.clear()
+        for train in sim.trains:
+            if train not in self.near:
+                sim.crosses.restart(train)
+        if sim.kinematics:
+            sim.kinematics.rebuild(sim.trains)
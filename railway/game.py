@@ -1,274 +1,250 @@
 import pygame
-import json
 import math
-import random
-from node import Node
-from railway.crosses import T_CRAFT
-from track import Track, CurvedTrack
-from train import Train
-from crosses import Crosses
+import time
+from profiler import FrameProfiler
+from simulation import Simulation, TICKS_PER_SECOND
+from spatial import RailwayIndex
+from layer import TrackLayer
+from dirty import DirtyRects
+from camera import Camera, ZOOM_STEP, PAN_STEP, LOD_FAR
+from commands import TOGGLE_TRACK, SPAWN_DRAISINE, AUTO_SWITCH, Session
+from render import draw_train, draw_train_pixels, draw_crosses
+
+FPS = 60  # частота отрисовки кадров
+TICK_MS = 1000 / TICKS_PER_SECOND  # длительность тика симуляции
+MAX_FRAME_MS = 250  # больше за один кадр не догоняем, иначе зависнем
+MAX_SPEED_BUDGET_MS = 12  # сколько времени кадра отдаём симуляции на скорости max
+TRACE_FILE = "frame_trace.json"  # куда F12 выгружает замеры кадров (ещё .jsonl рядом)
+MAX_WINDOW = (1280, 800)  # больше окно не делаем, остальную карту показывает камера
+
+# множители скорости по клавишам 1..4, 0 - максимально возможная скорость
+SPEEDS = {
+    pygame.K_1: 1,
+    pygame.K_2: 4,
+    pygame.K_3: 16,
+    pygame.K_4: 0,
+}
+
+# прокрутка стрелками: куда сдвигается карта, на PAN_STEP окна
+PAN_KEYS = {
+    pygame.K_LEFT: (1, 0),
+    pygame.K_RIGHT: (-1, 0),
+    pygame.K_UP: (0, 1),
+    pygame.K_DOWN: (0, -1),
+}
 
 class Game:
-    def __init__(self, grid_size_x, grid_size_y, cell_size):
+    def __init__(self, grid_size_x, grid_size_y, cell_size, seed=None, record=None):
         self.grid_size_x = grid_size_x
         self.grid_size_y = grid_size_y
         self.cell_size = cell_size
-        self.screen_size_x = grid_size_x * cell_size
-        self.screen_size_y = grid_size_y * cell_size
+        self.screen_size_x = min(grid_size_x * cell_size, MAX_WINDOW[0])
+        self.screen_size_y = min(grid_size_y * cell_size, MAX_WINDOW[1])
+        # колесо - масштаб, средняя кнопка и стрелки - прокрутка, Home - вся карта
+        self.camera = Camera(self.screen_size_x, self.screen_size_y,
+                             grid_size_x * cell_size, grid_size_y * cell_size)
+        self.dragging = False  # карту тащат средней кнопкой
         self.construction_mode = True
-        self.nodes = [[Node(x, y) for y in range(grid_size_y)] for x in range(grid_size_x)]
-        self.crosses = Crosses(self.nodes,cell_size)
-        self.tracks = []
-        self.trains = []
-        self.colors = [
-            (255, 0, 0),  # Красный
-            (0, 255, 0),  # Зелёный
-            (0, 0, 255),  # Синий
-            (255, 255, 0),  # Жёлтый
-            (255, 0, 255),  # Пурпурный
-            (0, 255, 255),  # Голубой
-            (128, 0, 128),  # Фиолетовый
-            (255, 165, 0)  # Оранжевый
-        ]
-        self.init_tracks()
-        self.init_stations()  # Инициализация станций
-        self.tr_started = 0 # обшее число поездов
+        self.sim = Simulation(grid_size_x, grid_size_y, cell_size, seed=seed)
+        self.record = record  # куда записать сеанс при выходе, см. replay.py
+        self.index = RailwayIndex(self.sim, cell_size)
+        self.hovered = set()  # пути под курсором
+        self.hover_key = None  # для какой позиции мыши и тика посчитан hovered
+        self.layer = None  # слой путей, создаётся вместе с окном
+        self.dirty = DirtyRects()  # что изменилось на экране за кадр
+        self.sprite_rects = []  # где в прошлом кадре нарисованы поезда и чекпоинты
+        self.sprites_key = None  # тик и интерполяция, для которых они нарисованы
+        self.speed = 1  # множитель скорости симуляции
+        self.accumulator = 0  # накопленное, но ещё не просчитанное время, мс
+        self.profiler = FrameProfiler()  # F3 - HUD с временем фаз, F12 - выгрузка trace
+        self.sim.profiler = self.profiler
         # self.load_state()
 
-    def init_stations(self):
-        """Выбирает 8 случайных узлов по периметру и назначает им цвета."""
-        perimeter_nodes = []
-
-        # Собираем узлы по периметру
-        for x in range(self.grid_size_x):
-            for y in range(self.grid_size_y):
-                if x == 0 or x == self.grid_size_x - 1 or y == 0 or y == self.grid_size_y - 1:
-                    perimeter_nodes.append(self.nodes[x][y])
-
-        # Выбираем 8 случайных узлов из периметра
-        self.stations = random.sample(perimeter_nodes, 8)
-
-        for i, node in enumerate(self.stations):
-            node.color = self.colors[i]  # Назначаем уникальный цвет
-            node.is_station = True  # Помечаем узел как станцию
-            good_tracks = []
-            for dir in node.outs:
-                for track in node.outs[dir]:
-                    oth_node = track.get_other_node(node)
-                    x, y = oth_node.x, oth_node.y
-                    if (x > 0 and x < self.grid_size_x - 1
-                    and y>0 and  y < self.grid_size_y - 1):
-                        good_tracks.append(track)
-            track = random.choice(good_tracks)
-            track.enabled = True
-            track.blocked = True
-
-    def init_tracks(self):
-        """Инициализирует пути между узлами."""
-        for x in range(self.grid_size_x):
-            for y in range(self.grid_size_y):
-                if x < self.grid_size_x - 1:
-                    self.tracks.append(Track(self.nodes[x][y], self.nodes[x + 1][y]))
-                if y < self.grid_size_y - 1:
-                    self.tracks.append(Track(self.nodes[x][y], self.nodes[x][y + 1]))
-                if x < self.grid_size_x - 1 and y < self.grid_size_y - 1:
-                    self.tracks.append(CurvedTrack(self.nodes[x][y], self.nodes[x + 1][y + 1], 'hor'))
-                    self.tracks.append(CurvedTrack(self.nodes[x][y], self.nodes[x + 1][y + 1], 'vert'))
-                if x < self.grid_size_x - 1 and y > 0:
-                    self.tracks.append(CurvedTrack(self.nodes[x][y], self.nodes[x + 1][y - 1], 'hor'))
-                    self.tracks.append(CurvedTrack(self.nodes[x][y], self.nodes[x + 1][y - 1], 'vert'))
-
-        for track in self.tracks:
-            track.assign_to_nodes()
-
-    def save_state(self, filename="save.json"):
+    def save_state(self, filename="save.rws"):
         """Сохраняет состояние игры в файл."""
-        data = {
-            "nodes": [],
-            "tracks": [],
-            "trains": [],
-            "construction_mode": self.construction_mode
-        }
-
-        # Сохраняем узлы
-        for row in self.nodes:
-            for node in row:
-                node_data = {
-                    "x": node.x,
-                    "y": node.y,
-                    "color": node.color,
-                    "is_station": node.is_station
-                }
-                data["nodes"].append(node_data)
-
-        # Сохраняем пути
-        for track in self.tracks:
-            track_data = {
-                "node1": [track.node1.x, track.node1.y],
-                "node2": [track.node2.x, track.node2.y],
-                "enabled": track.enabled,
-                "type": "CurvedTrack" if isinstance(track, CurvedTrack) else "Track",
-                "direction": track.direction if isinstance(track, CurvedTrack) else ''
-            }
-            data["tracks"].append(track_data)
+        self.sim.save_state(filename, self.construction_mode)
 
-        # Сохраняем поезда
-        for train in self.trains:
-            train_data = {
-                "start_node": [train.start_node.x, train.start_node.y],
-                "color": train.color,
-                "progress": train.progress,
-                "is_active": train.is_active
-            }
-            data["trains"].append(train_data)
-
-        # Записываем данные в файл
-        with open(filename, "w") as f:
-            json.dump(data, f, indent=4)
-
-    def load_state(self, filename="save.json"):
+    def load_state(self, filename="save.rws"):
         """Загружает состояние игры из файла."""
-        try:
-            with open(filename, "r") as f:
-                data = json.load(f)
-        except FileNotFoundError:
-            return  # Файл не существует
-
-        # Восстанавливаем узлы
-        for node_data in data["nodes"]:
-            x, y = node_data["x"], node_data["y"]
-            node = self.nodes[x][y]
-            node.color = node_data["color"]
-            node.is_station = node_data["is_station"]
-
-        # Восстанавливаем пути
-        self.tracks.clear()
-        for track_data in data["tracks"]:
-            node1 = self.nodes[track_data["node1"][0]][track_data["node1"][1]]
-            node2 = self.nodes[track_data["node2"][0]][track_data["node2"][1]]
-            if track_data["type"] == "CurvedTrack":
-                track = CurvedTrack(node1, node2, track_data["direction"])
-            else:
-                track = Track(node1, node2)
-            track.enabled = track_data["enabled"]
-            track.assign_to_nodes()
-            self.tracks.append(track)
-
-        # Восстанавливаем поезда
-        self.trains.clear()
-        for train_data in data["trains"]:
-            start_node = self.nodes[train_data["start_node"][0]][train_data["start_node"][1]]
-            train = Train(start_node, train_data["color"])
-            train.progress = train_data["progress"]
-            train.is_active = train_data["is_active"]
-            self.trains.append(train)
-
-        # Восстанавливаем режим
-        self.construction_mode = data["construction_mode"]
-
-    def startCraftTrain(self,node):
-        train_color = (80,80,20)
-        self.trains.append(Train(node, train_color, 2, T_CRAFT))
-
-    # Запустить очередной случайны поезд
-    def startRandomNexrTrain(self):
-        max_statuin_cnt = self.tr_started // 5 + 2
-        colors = []
-        stations = []
-        cnt = 0
-        for node in self.stations:
-            if cnt>=max_statuin_cnt:
-                break;
-            stations.append(node)
-            colors.append(node.color)
-            cnt += 1
-
-        cur_station = random.choice(stations)
-        if cur_station.is_station_bisy():
-            return
-
-        available_colors = [color for color in colors if color != cur_station.color]
-        train_color = random.choice(available_colors)
-        self.trains.append(Train(cur_station, train_color, random.randint(2, 5)))
-        self.tr_started += 1
+        data = self.sim.load_state(filename)
+        if data:
+            self.index = RailwayIndex(self.sim, self.cell_size)
+            self.hover_key = None
+            if self.layer:
+                self.layer = TrackLayer(self.sim, self.index, self.layer.surface.get_size(), self.camera)
+            # Восстанавливаем режим
+            self.construction_mode = data["construction_mode"]
+
+    def update_caption(self):
+        speed = 'max' if not self.speed else 'x%d' % self.speed
+        auto = ' auto' if self.sim.auto_switch else ''
+        pygame.display.set_caption("Railway Simulator " + speed + auto)
+
+    def advance_simulation(self, frame_ms):
+        """Прогоняет столько тиков, сколько положено за прошедший кадр.
+
+        Тики фиксированной длины, поэтому скорость движения не зависит от FPS:
+        на медленной машине за кадр считается несколько тиков, на быстрой
+        остаток копится в accumulator. Возвращает долю следующего тика
+        для интерполяции положения вагонов.
+        """
+        if self.construction_mode:
+            self.accumulator = 0
+            return 1.0
+
+        if not self.speed:
+            # максимальная скорость: считаем, пока не кончится бюджет кадра
+            deadline = time.perf_counter() + MAX_SPEED_BUDGET_MS / 1000
+            while time.perf_counter() < deadline:
+                self.sim.step(10)
+            self.accumulator = 0
+            return 1.0
+
+        self.accumulator += min(frame_ms, MAX_FRAME_MS) * self.speed
+        ticks = int(self.accumulator // TICK_MS)
+        self.accumulator -= ticks * TICK_MS
+        self.sim.step(ticks)
+        return self.accumulator / TICK_MS
+
+    def update_hovered(self, mouse_pos):
+        """Пересчитывает пути под курсором, только если сдвинулась мышь, камера или прошёл тик."""
+        key = (mouse_pos, self.sim.ticks, self.camera.key())
+        if key != self.hover_key:
+            self.hover_key = key
+            self.hovered = set(self.index.hovered_tracks(*self.camera.to_world(*mouse_pos)))
+
+    def draw_frame(self, screen, alpha):
+        """Рисует кадр поверх прошлого и выводит на дисплей только изменённые места."""
+        dirty = self.dirty
+        phase = self.profiler.phase
+        sprites_key = (self.sim.ticks, alpha, self.camera.key())
+        # HUD меняется каждый кадр, его стираем и рисуем вместе с поездами
+        moved = sprites_key != self.sprites_key or self.profiler.visible
+        if moved:
+            # стираем поезда и чекпоинты прошлого кадра
+            for rect in self.sprite_rects:
+                self.layer.restore(screen, rect, dirty)
+
+        # В режиме конструирования отображаем все пути,
+        # в режиме управления только активные
+        with phase('layer'):
+            self.layer.set_mode(self.construction_mode)
+            self.layer.set_hovered(self.hovered)
+            self.layer.draw(screen, dirty)
+            self.layer.draw_controls(screen, dirty)
+
+        if moved or not dirty.is_empty():
+            self.sprites_key = sprites_key
+            # Рисуем поезда
+            self.sprite_rects = []
+            # на дальнем виде поезда точками, а занятые чекпоинты под ними не видны
+            far = self.camera.lod(self.cell_size) == LOD_FAR
+            with phase('trains_draw'):
+                if far:
+                    self.sprite_rects.extend(draw_train_pixels(screen, self.sim.trains, self.cell_size,
+                                                               self.camera, alpha))
+                else:
+                    for train in self.sim.trains:
+                        self.sprite_rects.extend(draw_train(screen, train, self.cell_size, self.camera, alpha))
+            with phase('crosses_draw'):
+                self.sprite_rects.extend(draw_crosses(screen, self.sim.crosses, self.camera, show_occupied=not far))
+            if self.profiler.visible:
+                self.sprite_rects.append(self.profiler.draw(screen))
+            for rect in self.sprite_rects:
+                dirty.add(rect)
+
+        with phase('display'):
+            dirty.update()
+
+    def handle_events(self):
+        """Обрабатывает события окна, возвращает False, если игру закрыли."""
+        running = True
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                # self.save_state()
+                if self.record:
+                    Session.from_simulation(self.sim).save(self.record)
+                running = False
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                self.layer.expose()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
+                self.construction_mode = not self.construction_mode
+            elif event.type == pygame.KEYDOWN and event.key in SPEEDS:
+                self.speed = SPEEDS[event.key]
+                self.update_caption()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_a:
+                # стрелки перед поездами ставятся по маршруту к их станциям
+                self.sim.execute((AUTO_SWITCH, int(not self.sim.auto_switch), 0, 0))
+                self.update_caption()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.profiler.toggle()
+                if not self.profiler.visible:
+                    self.layer.expose()  # стираем HUD
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F12:
+                self.profiler.dump(TRACE_FILE)
+                self.profiler.dump(TRACE_FILE + "l")
+            elif event.type == pygame.KEYDOWN and event.key in PAN_KEYS:
+                dx, dy = PAN_KEYS[event.key]
+                self.camera.pan(dx * PAN_STEP * self.screen_size_x, dy * PAN_STEP * self.screen_size_y)
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_HOME:
+                self.camera.fit()
+            elif event.type == pygame.MOUSEWHEEL:
+                self.camera.zoom_at(ZOOM_STEP ** event.y, *pygame.mouse.get_pos())
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 2:
+                self.dragging = True
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 2:
+                self.dragging = False
+            elif event.type == pygame.MOUSEMOTION and self.dragging:
+                self.camera.pan(*event.rel)
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                # мышь в координатах холста, в них работают индекс и узлы
+                mouse_x, mouse_y = self.camera.to_world(*event.pos)
+                if self.construction_mode:
+                    # В режиме конструирования переключаем пути
+                    for track in self.index.hovered_tracks(mouse_x, mouse_y):
+                        self.sim.execute((TOGGLE_TRACK,) + track.key)
+                        self.layer.invalidate_track(track)
+                else:
+                    # В режиме управления переключаем стрелки и семафоры
+                    for node in self.index.nodes_near(mouse_x, mouse_y):
+                        for command in node.click_commands(mouse_x, mouse_y, self.cell_size):
+                            self.sim.execute(command)
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 3:  # Правая кнопка мыши
+                mouse_x, mouse_y = self.camera.to_world(*event.pos)
+                if not self.construction_mode:
+                    for node in self.index.nodes_near(mouse_x, mouse_y):
+                        if (node.is_station and node.is_terminal()
+                        and math.hypot(
+                                node.getCanvasX(self.cell_size) - mouse_x,
+                                node.getCanvasY(self.cell_size) - mouse_y) < 10):
+                            # Создаём поезд случайного цвета, отличного от цвета станции
+                            self.sim.execute((SPAWN_DRAISINE, node.x, node.y, 0))
+        return running
 
     def run(self):
         """Запускает игру."""
         pygame.init()
         screen = pygame.display.set_mode((self.screen_size_x, self.screen_size_y))
-        pygame.display.set_caption("Railway Simulator")
+        self.update_caption()
         clock = pygame.time.Clock()
+        self.layer = TrackLayer(self.sim, self.index, screen.get_size(), self.camera)
+        frame_ms = 0
 
         running = True
         while running:
-            screen.fill((255, 255, 255))
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    # self.save_state()
-                    running = False
-                elif event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                    self.construction_mode = not self.construction_mode
-                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                    if self.construction_mode:
-                        # В режиме конструирования переключаем пути
-                        for track in self.tracks:
-                            if track.is_hovered(*pygame.mouse.get_pos(), self.cell_size):
-                                track.toggle()
-                    else:
-                        # В режиме управления переключаем стрелки и семафоры
-                        for row in self.nodes:
-                            for node in row:
-                                node.handle_click(*pygame.mouse.get_pos(), self.cell_size)
-                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 3:  # Правая кнопка мыши
-                    if not self.construction_mode:
-                        for row in self.nodes:
-                            for node in row:
-                                if (node.is_station and node.is_terminal()
-                                and math.hypot(
-                                        node.getCanvasX(self.cell_size) - pygame.mouse.get_pos()[0],
-                                        node.getCanvasY(self.cell_size) - pygame.mouse.get_pos()[1]) < 10):
-                                    # Создаём поезд случайного цвета, отличного от цвета станции
-                                    self.startCraftTrain(node)
-
-            mouse_pos = pygame.mouse.get_pos()
-
-            if self.construction_mode:
-                # В режиме конструирования отображаем все пути
-                for track in self.tracks:
-                    track.draw(screen, mouse_pos, self.construction_mode, self.cell_size)
-            else:
-                # В режиме управления отображаем только активные пути
-
-                if not self.trains or random.random() < 0.001 / (len(self.trains)+1):
-                    self.startRandomNexrTrain()
-
-                for track in self.tracks:
-                    if track.enabled:
-                        track.draw(screen, mouse_pos, self.construction_mode, self.cell_size)
-                    track.bisy = False
-
-            for row in self.nodes:
-                for node in row:
-                    node.draw(screen, self.construction_mode, self.cell_size)
-                    if not self.construction_mode:
-                        node.blocked_dirs = {} #обнуление блоеироаок стрелок
-
-            self.crosses.clear()
-
-            # Обновляем и рисуем поезда
-            for train in self.trains:
-                if not self.construction_mode:
-                    train.update(self.nodes)
-                    if not train.is_active:
-                        self.trains.remove(train)
+            self.profiler.begin_frame()
+            with self.profiler.phase('events'):
+                running = self.handle_events()
 
-                self.crosses.new_train(train)
-                train.draw(screen, self.cell_size, self.crosses)
+            # движение, запуск поездов и аварии считает симуляция
+            with self.profiler.phase('simulation'):
+                alpha = self.advance_simulation(frame_ms)
 
-            self.crosses.draw(screen)
+            with self.profiler.phase('hover'):
+                self.update_hovered(pygame.mouse.get_pos())
 
-            pygame.display.flip()
-            clock.tick(60)
+            self.draw_frame(screen, alpha)
+            self.profiler.end_frame()
+            frame_ms = clock.tick(FPS)
 
-        pygame.quit()
\ No newline at end of file
+        pygame.quit()
@@ -0,0 +1,79 @@
+import math
+
+SEGMENTS = 32  # отрезков в таблице положений вдоль пути
+
+# таблицы положений (xs, ys) относительно node1, общие для путей одной формы
+TABLES = []
+_table_ids = {}  # форма пути -> номер таблицы в TABLES
+
+
+def _table(key, point):
+    """Номер таблицы для формы key, точки считаются point(t) один раз."""
+    table = _table_ids.get(key)
+    if table is None:
+        points = [point(i / SEGMENTS) for i in range(SEGMENTS + 1)]
+        TABLES.append(([x for x, _ in points], [y for _, y in points]))
+        table = _table_ids[key] = len(TABLES) - 1
+    return table
+
+
+def line_table(dx, dy):
+    """Таблица прямого пути со смещением второго узла (dx, dy)."""
+    return _table(('line', dx, dy), lambda t: (dx * t, dy * t))
+
+
+def arc_table(cx, cy, radius, start_angle, end_angle):
+    """Таблица дуги с центром (cx, cy) относительно node1."""
+    def point(t):
+        angle = start_angle + (end_angle - start_angle) * t
+        return cx + radius * math.cos(angle), cy - radius * math.sin(angle)
+    return _table(('arc', cx, cy, radius, start_angle, end_angle), point)
+
+
+class TrackGeometry:
+    """Координаты пути на холсте при одном размере клетки.
+
+    Считаются один раз и пересчитываются, только если сменился размер
+    клетки. Положение на пути берётся из таблицы точек с линейной
+    интерполяцией, без cos/sin на каждый вагон.
+    """
+    __slots__ = ('cell_size', 'x1', 'y1', 'x2', 'y2', 'x_min', 'y_min', 'x_max', 'y_max',
+                 'length', 'center_x', 'center_y', 'start_angle', 'end_angle', 'table')
+
+    def __init__(self, cell_size, x1, y1, x2, y2, table, arc=None):
+        self.cell_size = cell_size
+        self.x1, self.y1, self.x2, self.y2 = x1, y1, x2, y2
+        self.x_min, self.x_max = min(x1, x2), max(x1, x2)
+        self.y_min, self.y_max = min(y1, y2), max(y1, y2)
+        self.length = math.hypot(x2 - x1, y2 - y1)
+        # дуга: центр и углы от node1 к node2, у прямого пути None
+        self.center_x, self.center_y, self.start_angle, self.end_angle = arc or (None,) * 4
+        self.table = table
+
+    def position(self, progress):
+        """Координаты точки на пути, progress от 0 (node1) до 1 (node2).
+
+        Прогресс за пределами 0..1 у вагонов бывает после разворота. Прямой
+        путь таблица продолжает верно, а дуга за концами продолжается по
+        окружности, это считается точно через cos/sin (arc_position).
+        """
+        if self.center_x is not None and not 0 <= progress <= 1:
+            return self.arc_position(progress)
+        xs, ys = TABLES[self.table]
+        f = progress * SEGMENTS
+        i = int(f)
+        if i < 0:
+            i = 0
+        elif i >= SEGMENTS:
+            i = SEGMENTS - 1
+        frac = f - i
+        x = self.x1 + xs[i] + (xs[i + 1] - xs[i]) * frac
+        y = self.y1 + ys[i] + (ys[i + 1] - ys[i]) * frac
+        return int(x), int(y)
+
+    def arc_position(self, progress):
+        """Точка дуги радиусом в клетку при любом progress, без таблицы."""
+        angle = self.start_angle + (self.end_angle - self.start_angle) * progress
+        x = self.center_x + self.cell_size * math.cos(angle)
+        y = self.center_y - self.cell_size * math.sin(angle)
+        return int(x), int(y)
@@ -0,0 +1,74 @@
+from array import array
+from track import CurvedTrack
+from vagon import CURVE_SPEED
+
+CURVE_COST = 1 / CURVE_SPEED  # дуга проезжается дольше прямой
+SLOT_TRACKS = 2  # больше двух путей в одном направлении узла не бывает, см. Node.can_add_track
+
+
+def track_cost(track):
+    """Время проезда пути в долях времени проезда прямого."""
+    return CURVE_COST if isinstance(track, CurvedTrack) else 1.0
+
+
+class RailGraph:
+    """Смежность построенных путей в плоских массивах, для поиска по всему графу.
+
+    Слот - узел и направление выезда из него: node.index * 4 + direction,
+    противоположное направление того же узла - slot ^ 1. Пути слота лежат
+    подряд с шагом SLOT_TRACKS (ребро slot * SLOT_TRACKS + k) в порядке
+    Node.dir_tracks, у каждого ребра записаны слот того же пути на другом
+    конце (соседний узел и направление выезда оттуда обратно) и время
+    проезда. Поиск идёт по числам, без вызовов методов путей и словарей.
+
+    Узлы и пути остаются объектами, граф только повторяет их смежность:
+    слоты узла переписываются на месте, когда меняются его пути
+    (Simulation.register_track).
+    """
+
+    def __init__(self, node_count):
+        self.slots = node_count * 4
+        size = self.slots * SLOT_TRACKS
+        self.count = bytearray(self.slots)  # сколько путей в слоте
+        self.tracks = [None] * size  # путь ребра
+        self.far = array('i', [0]) * size  # слот пути на другом конце ребра
+        self.cost = array('d', [0.0]) * size  # время проезда ребра
+
+    def clear(self):
+        """Убирает все пути (загрузка карты)."""
+        self.count = bytearray(self.slots)
+        self.tracks = [None] * len(self.tracks)
+
+    def update_node(self, node):
+        """Переписывает слоты узла по его включённым путям."""
+        base = node.index * 4
+        for direction, tracks in enumerate(node.dir_tracks):
+            if len(tracks) > SLOT_TRACKS:
+                raise ValueError("в узле (%d, %d) больше %d путей в одном направлении"
+                                 % (node.x, node.y, SLOT_TRACKS))
+            slot = base + direction
+            self.count[slot] = len(tracks)
+            for k, track in enumerate(tracks):
+                edge = slot * SLOT_TRACKS + k
+                other = track.get_other_node(node)
+                self.tracks[edge] = track
+                self.far[edge] = other.index * 4 + track.get_exit_direction(other)
+                self.cost[edge] = track_cost(track)
+
+    def edge(self, node, track):
+        """Ребро пути track в слотах node или -1, если путь в узле не построен."""
+        slot = node.index * 4 + track.get_exit_direction(node)
+        first = slot * SLOT_TRACKS
+        for edge in range(first, first + self.count[slot]):
+            if self.tracks[edge] is track:
+                return edge
+        return -1
+
+    def edges(self):
+        """Рёбра как (слот, ключ пути, слот на другом конце), для сверки графов."""
+        result = set()
+        for slot in range(self.slots):
+            first = slot * SLOT_TRACKS
+            for edge in range(first, first + self.count[slot]):
+                result.add((slot, self.tracks[edge].key, self.far[edge]))
+        return result
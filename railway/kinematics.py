@@ -0,0 +1,141 @@
+try:
+    import numpy as np
+except ImportError:  # движок необязательный, без numpy симуляция считает по вагонам
+    np = None
+from track import CurvedTrack
+from vagon import VAGON_LEN, CURVE_SPEED
+from geometry import TABLES, SEGMENTS
+
+
+class BatchKinematics:
+    """Движение всех вагонов одним векторным шагом numpy.
+
+    Прогресс, шаг и геометрия текущего пути каждого вагона лежат в массивах
+    (вагоны одного поезда подряд). За тик прогресс сдвигается сразу у всех.
+    Поезда, у которых хоть один вагон доезжает до узла или выпускает
+    следующий вагон со станции, отдаются обратно в обычный Train.update:
+    стрелки, семафоры и развороты считаются по объектам как раньше.
+    """
+
+    def __init__(self, cell_size):
+        if np is None:
+            raise ImportError("для пакетного движения вагонов нужен numpy")
+        self.cell_size = cell_size
+        self.trains = []  # поезда, по которым построены массивы
+        self.train_index = {}
+        self.vagons = []
+        self.starts = None  # индекс первого вагона каждого поезда
+
+        self.progress = None
+        self.step_size = None  # сдвиг прогресса за тик
+        self.moving = None  # вагон активен и стоит на пути
+        self.threshold = None  # прогресс, при котором начинается событие
+        # геометрия: начало пути x1,y1 и номер таблицы положений, см. TrackGeometry
+        self.forward = None  # вагон едет от node1 к node2
+        self.x1 = self.y1 = None
+        self.table = None
+        self.arc = None  # вагон на дуге, за пределами 0..1 она считается точно
+        self.table_xs = self.table_ys = None  # копия TABLES для numpy
+
+    def rebuild(self, trains):
+        """Раскладывает вагоны по массивам заново (появились или ушли поезда)."""
+        self.trains = list(trains)
+        self.train_index = {train: t for t, train in enumerate(self.trains)}
+        self.vagons = [vagon for train in self.trains for vagon in train.vagons]
+        starts = []
+        pos = 0
+        for train in self.trains:
+            starts.append(pos)
+            pos += len(train.vagons)
+        self.starts = np.array(starts, dtype=np.intp)
+
+        n = len(self.vagons)
+        self.progress = np.zeros(n)
+        self.step_size = np.zeros(n)
+        self.threshold = np.ones(n)
+        self.moving = np.zeros(n, dtype=bool)
+        self.forward = np.ones(n, dtype=bool)
+        self.x1, self.y1 = np.zeros(n), np.zeros(n)
+        self.table = np.zeros(n, dtype=np.intp)
+        self.arc = np.zeros(n, dtype=bool)
+        for i in range(n):
+            self.load_vagon(i)
+
+    def invalidate(self):
+        """Поезда из TrainPool могли вернуться на те же места списка, массивы строим заново."""
+        self.trains = None
+
+    def load_vagon(self, i):
+        """Копирует состояние вагона в массивы."""
+        vagon = self.vagons[i]
+        track = vagon.current_track
+        self.progress[i] = vagon.progress
+        self.moving[i] = vagon.is_active and track is not None
+        self.threshold[i] = VAGON_LEN if vagon.is_pre_tail else 1
+        if not track:
+            return
+
+        self.forward[i] = track.node1 == vagon.start_node
+        self.step_size[i] = 0.01 * (CURVE_SPEED if isinstance(track, CurvedTrack) else 1.0)
+        geometry = track.get_geometry(self.cell_size)
+        self.x1[i], self.y1[i] = geometry.x1, geometry.y1
+        self.table[i] = geometry.table
+        self.arc[i] = geometry.center_x is not None
+
+    def refresh(self, train):
+        """Вагоны поезда сдвинуты по объектам, перечитываем их."""
+        start = self.starts[self.train_index[train]]
+        for i in range(start, start + len(train.vagons)):
+            self.load_vagon(i)
+
+    def step(self, trains):
+        """Сдвигает вагоны поездов без событий, возвращает поезда для Train.update."""
+        if trains != self.trains:
+            self.rebuild(trains)
+        if not self.vagons:
+            return set()
+
+        new_progress = self.progress + self.step_size
+        events = self.moving & (new_progress >= self.threshold)
+        train_events = np.add.reduceat(events, self.starts) > 0
+
+        fallback = set()
+        for train, has_event in zip(self.trains, train_events.tolist()):
+            if has_event or not train.is_active:
+                fallback.add(train)
+
+        # сдвигаем только поезда без событий, остальные посчитает Train.update
+        vagon_events = np.repeat(train_events, np.diff(np.append(self.starts, len(self.vagons))))
+        move = self.moving & ~vagon_events
+        np.copyto(self.progress, new_progress, where=move)
+
+        # координаты на холсте так же, как в TrackGeometry.position
+        if not TABLES:  # ни один вагон ещё не стоит на пути
+            return fallback
+        if self.table_xs is None or len(self.table_xs) != len(TABLES):
+            self.table_xs = np.array([xs for xs, _ in TABLES])
+            self.table_ys = np.array([ys for _, ys in TABLES])
+        on_track = np.where(self.forward, self.progress, 1 - self.progress)
+        f = on_track * SEGMENTS
+        seg = np.clip(f.astype(np.intp), 0, SEGMENTS - 1)
+        frac = f - seg
+        tx = self.table_xs[self.table, seg]
+        ty = self.table_ys[self.table, seg]
+        xs = (self.x1 + tx + (self.table_xs[self.table, seg + 1] - tx) * frac).astype(int)
+        ys = (self.y1 + ty + (self.table_ys[self.table, seg + 1] - ty) * frac).astype(int)
+        # дуга за своими концами продолжается по окружности, а не по таблице
+        for i in np.flatnonzero(self.moving & self.arc & ((on_track < 0) | (on_track > 1))).tolist():
+            geometry = self.vagons[i].current_track.get_geometry(self.cell_size)
+            xs[i], ys[i] = geometry.arc_position(on_track[i])
+
+        for vagon, moved, p, x, y in zip(self.vagons, move.tolist(), self.progress.tolist(),
+                                         xs.tolist(), ys.tolist()):
+            if vagon.train in fallback:
+                continue
+            if moved:
+                vagon.progress = p
+                vagon.prev_pos, vagon.pos = vagon.pos, (x, y)
+            else:
+                vagon.prev_pos, vagon.pos = vagon.pos, None
+
+        return fallback
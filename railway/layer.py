@@ -0,0 +1,267 @@
+import math
+import pygame
+from camera import Camera, LOD_NEAR, LOD_FAR, FAR_CELL
+from render import draw_track, draw_marker, draw_controls, draw_checkpoints
+
+BG_COLOR = (255, 255, 255)
+DIRTY_MARGIN = 10  # запас вокруг пути: толщина линии и кружки станций на концах
+MINIMAP_MAX = 2048  # сторона миникарты не больше стольких пикселей
+
+
+class TrackLayer:
+    """Заранее отрисованная сеть путей и станций.
+
+    Пути меняются только при переключении или наведении, поэтому они
+    рисуются во внеэкранную поверхность размером с окно, а на экран из
+    неё копируются только испорченные области и места, где в прошлом
+    кадре были поезда. Рисуется только то, что видно в камеру; при
+    прокрутке слой сдвигается, и дорисовываются только открывшиеся полосы,
+    при смене масштаба видимая часть перерисовывается целиком.
+
+    Детализация зависит от размера клетки на экране (Camera.lod): на
+    среднем уровне не рисуются стрелки, семафоры и пустые чекпоинты, на
+    дальнем пути не рисуются вовсе - слой берётся из миникарты, один раз
+    отрисованной сети построенных путей в мелком масштабе, которая
+    уменьшается под окно одним smoothscale.
+    """
+
+    def __init__(self, sim, index, size, camera):
+        self.sim = sim
+        self.index = index
+        self.cell_size = sim.cell_size
+        self.camera = camera
+        self.view = None  # camera.key(), при котором нарисован слой
+        self.surface = pygame.Surface(size)
+        self.construction_mode = None
+        self.hovered = set()
+        self.dirty = []  # прямоугольники холста (x_min, y_min, x_max, y_max), которые нужно перерисовать
+        self.full_redraw = True
+        self.full_blit = True  # экран нужно восстановить целиком
+        self.control_nodes = set()  # узлы со стрелками и семафорами
+        self.controls_state = {}  # узел -> как выглядели его стрелки на экране
+        self.visible_controls = set()  # узлы со стрелками в окне
+        self.visible_key = None  # для какого вида и набора узлов они отобраны
+        self.minimap = None  # построенные пути в мелком масштабе, рисуется при первом дальнем виде
+        self.minimap_camera = None
+        self.minimap_dirty = []  # прямоугольники холста, устаревшие на миникарте
+        self.far_view = None  # миникарта, уменьшенная под окно
+        self.far_key = None  # для какого вида она уменьшена
+        self.rebuild()
+
+    def rebuild(self):
+        """Полная перерисовка, например после загрузки карты."""
+        self.control_nodes = {node for track in self.sim.tracks.values()
+                              for node in (track.node1, track.node2) if node.has_controls()}
+        self.visible_key = None
+        self.minimap = None
+        self.far_key = None
+        self.full_redraw = True
+
+    def expose(self):
+        """Окно перекрывали, экран надо восстановить целиком."""
+        self.full_blit = True
+
+    def set_mode(self, construction_mode):
+        if construction_mode != self.construction_mode:
+            self.construction_mode = construction_mode
+            self.full_redraw = True
+
+    def set_hovered(self, hovered):
+        """Меняет пути под курсором, портятся только их области."""
+        if hovered == self.hovered:
+            return
+        for track in hovered ^ self.hovered:
+            self.invalidate_track(track, built=False)
+        self.hovered = hovered
+
+    def invalidate_track(self, track, built=True):
+        """Путь включили/выключили (built) или сменился только его цвет."""
+        cs = self.cell_size
+        g = track.get_geometry(cs)
+        area = (g.x_min - DIRTY_MARGIN, g.y_min - DIRTY_MARGIN,
+                g.x_max + DIRTY_MARGIN, g.y_max + DIRTY_MARGIN)
+        self.dirty.append(area)
+        if built and self.minimap is not None:
+            self.minimap_dirty.append(area)
+        for node in (track.node1, track.node2):
+            if node.has_controls():
+                self.control_nodes.add(node)
+            else:
+                self.control_nodes.discard(node)
+                self.controls_state.pop(node, None)
+            self.dirty.append(node.get_controls_area(cs))
+        self.visible_key = None
+
+    def controls_rect(self, node):
+        """Где на экране стрелки и семафоры узла."""
+        return self.camera.screen_rect(*node.get_controls_area(self.cell_size))
+
+    def redraw(self, rect):
+        """Перерисовывает прямоугольник слоя."""
+        camera = self.camera
+        lod = camera.lod(self.cell_size)
+        if lod == LOD_FAR:
+            self.surface.blit(self.get_far_view(), rect, rect)
+            return
+        self.draw_network(self.surface, camera, rect, self.construction_mode, self.hovered)
+        if lod == LOD_NEAR:
+            draw_checkpoints(self.surface, self.sim.crosses, rect, camera)
+        self.surface.set_clip(None)
+
+    def draw_network(self, surface, camera, rect, construction_mode, hovered):
+        """Пути и станции в прямоугольнике rect поверхности, клип остаётся на rect."""
+        surface.set_clip(rect)
+        surface.fill(BG_COLOR, rect)
+        # заходящие в прямоугольник края соседних путей и маркеров тоже перерисовываем
+        x_min, y_min, x_max, y_max = camera.world_rect(rect)
+        margin = DIRTY_MARGIN + 1 / camera.scale
+        area = (x_min - margin, y_min - margin, x_max + margin, y_max + margin)
+
+        # в режиме управления видны только построенные пути
+        for track in self.index.tracks_in_rect(*area, built=not construction_mode):
+            draw_track(surface, track, track in hovered, construction_mode, self.cell_size, camera)
+
+        for node in self.index.nodes.query_rect(*area):
+            draw_marker(surface, node, self.cell_size, camera)
+
+    def get_minimap(self):
+        """Миникарта с дорисованными изменениями путей."""
+        if self.minimap is None:
+            sim = self.sim
+            cs = self.cell_size
+            # клетка миникарты не крупнее дальнего уровня, его миникарта только уменьшает
+            cell = max(1, min(FAR_CELL, MINIMAP_MAX // max(sim.grid_size_x, sim.grid_size_y)))
+            width, height = sim.grid_size_x * cell, sim.grid_size_y * cell
+            self.minimap_camera = Camera(width, height, sim.grid_size_x * cs, sim.grid_size_y * cs)
+            self.minimap_camera.fit()
+            self.minimap = pygame.Surface((width, height))
+            self.minimap_dirty = []
+            self.draw_network(self.minimap, self.minimap_camera, self.minimap.get_rect(), False, ())
+            self.minimap.set_clip(None)
+        elif self.minimap_dirty:
+            camera = self.minimap_camera
+            bounds = self.minimap.get_rect()
+            for area in self.minimap_dirty:
+                rect = camera.screen_rect(*area).clip(bounds)
+                if rect:
+                    self.draw_network(self.minimap, camera, rect, False, ())
+            self.minimap.set_clip(None)
+            self.minimap_dirty = []
+            self.far_key = None
+        return self.minimap
+
+    def get_far_view(self):
+        """Видимая часть миникарты в масштабе камеры, пересчитывается при смене вида."""
+        minimap = self.get_minimap()  # изменения путей сбрасывают far_key
+        key = self.camera.key()
+        if key != self.far_key:
+            self.far_key = key
+            self.far_view = self.make_far_view(minimap)
+        return self.far_view
+
+    def make_far_view(self, minimap):
+        camera = self.camera
+        mini = self.minimap_camera.scale
+        x_min, y_min, x_max, y_max = camera.world_rect()
+        # пиксели миникарты, закрывающие окно, и где их углы окажутся на экране
+        left, top = max(0, math.floor(x_min * mini)), max(0, math.floor(y_min * mini))
+        right = min(minimap.get_width(), math.ceil(x_max * mini))
+        bottom = min(minimap.get_height(), math.ceil(y_max * mini))
+        view = pygame.Surface(self.surface.get_size())
+        view.fill(BG_COLOR)
+        if right <= left or bottom <= top:
+            return view
+        screen_left, screen_top = camera.to_screen(left / mini, top / mini)
+        screen_right, screen_bottom = camera.to_screen(right / mini, bottom / mini)
+        part = minimap.subsurface((left, top, right - left, bottom - top))
+        size = (max(1, screen_right - screen_left), max(1, screen_bottom - screen_top))
+        view.blit(pygame.transform.smoothscale(part, size), (screen_left, screen_top))
+        return view
+
+    def restore(self, screen, rect, dirty):
+        """Стирает с экрана всё нарисованное поверх слоя в прямоугольнике."""
+        screen.blit(self.surface, rect, rect)
+        dirty.add(rect)
+
+    def scroll(self, dx, dy):
+        """Сдвигает слой вслед за камерой, дорисовывает открывшиеся полосы."""
+        width, height = self.surface.get_size()
+        if abs(dx) >= width or abs(dy) >= height:
+            self.full_redraw = True
+            return
+        self.surface.scroll(dx, dy)
+        if dx:
+            self.redraw(pygame.Rect(0 if dx > 0 else width + dx, 0, abs(dx), height))
+        if dy:
+            self.redraw(pygame.Rect(0, 0 if dy > 0 else height + dy, width, abs(dy)))
+
+    def draw(self, screen, dirty):
+        """Дорисовывает испорченные области слоя и переносит их на экран."""
+        view = self.camera.key()
+        far = self.camera.lod(self.cell_size) == LOD_FAR
+        if view != self.view:
+            # тот же масштаб - прокрутка, иначе видна другая часть карты в другом размере;
+            # дальний вид всё равно уменьшается из миникарты заново
+            if self.view and view[0] == self.view[0] and not self.full_redraw and not far:
+                self.scroll(self.view[1] - view[1], self.view[2] - view[2])
+            else:
+                self.full_redraw = True
+            self.view = view
+            self.full_blit = True
+
+        if far and self.minimap_dirty:
+            self.full_redraw = True  # уменьшенная миникарта меняется не только в испорченных местах
+
+        if self.full_redraw:
+            self.full_redraw = False
+            self.dirty = []
+            self.redraw(self.surface.get_rect())
+            self.full_blit = True
+        elif self.dirty:
+            bounds = self.surface.get_rect()
+            for area in self.dirty:
+                rect = self.camera.screen_rect(*area).clip(bounds)
+                if rect:
+                    self.redraw(rect)
+                    self.restore(screen, rect, dirty)
+            self.dirty = []
+
+        if self.full_blit:
+            self.full_blit = False
+            screen.blit(self.surface, (0, 0))
+            dirty.add_full()
+
+    def draw_controls(self, screen, dirty):
+        """Рисует стрелки и семафоры, которые изменились или оказались в стёртых областях."""
+        if self.construction_mode or self.camera.lod(self.cell_size) != LOD_NEAR:
+            return
+        camera = self.camera
+        visible = self.get_visible_controls()
+
+        # сначала стираем изменившиеся, чтобы не задеть уже нарисованных соседей
+        to_draw = set()
+        for node in visible:
+            state = node.get_controls_state()
+            if self.controls_state.get(node) != state:
+                self.controls_state[node] = state
+                self.restore(screen, self.controls_rect(node), dirty)
+                to_draw.add(node)
+
+        if dirty.full:
+            to_draw = visible
+        else:
+            for rect in dirty.rects:
+                for node in self.index.nodes.query_rect(*camera.world_rect(rect)):
+                    if node in self.control_nodes:
+                        to_draw.add(node)
+
+        for node in to_draw:
+            draw_controls(screen, node, self.cell_size, camera)
+
+    def get_visible_controls(self):
+        """Узлы со стрелками и семафорами в окне, отбираются через индекс узлов."""
+        key = self.camera.key()
+        if key != self.visible_key:
+            self.visible_key = key
+            self.visible_controls = self.index.nodes.query_rect(*self.camera.world_rect()) & self.control_nodes
+        return self.visible_controls
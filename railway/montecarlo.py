@@ -0,0 +1,104 @@
+"""Оценка карт множеством случайных прогонов на всех ядрах.
+
+Запуск: python montecarlo.py layout.rws [layout2.rws ...] [--runs 64] [--ticks 20000]
+
+Каждый прогон загружает карту, сохранённую save_state (или export_json),
+убирает с неё поезда и крутит симуляцию без окна с новым зерном, поезда
+выпускаются как в игре (startRandomNexrTrain). С --events симуляция
+перематывается по событиям (Simulation.fast_forward), итоги те же;
+быстрее это только на картах, где поезда редко встречаются.
+С --swept столкновения ищутся по всему пройденному пути
+(Crosses.sweep_trains). Прогоны раздаются по процессам
+ProcessPoolExecutor, итоги по каждой карте печатаются JSON: доставки,
+аварии, развороты и среднее время поездки.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from simulation import Simulation
+import snapshot
+
+COUNTERS = ('delivered', 'crashed', 'reversals')
+
+
+def layout_grid_size(filename):
+    """Размер карты из снимка или JSON."""
+    if snapshot.is_snapshot(filename):
+        return snapshot.read_grid_size(filename)
+    with open(filename) as f:
+        nodes = json.load(f)["nodes"]
+    return max(node["x"] for node in nodes) + 1, max(node["y"] for node in nodes) + 1
+
+
+def run_layout(filename, seed, ticks, batched=False, events=False, swept=False):
+    """Один прогон карты, возвращает Simulation.get_stats()."""
+    sim = Simulation(*layout_grid_size(filename), batched=batched, seed=seed, swept=swept)
+    sim.load_state(filename)
+    sim.reset_traffic()
+    if events:
+        sim.fast_forward(ticks)
+    else:
+        sim.step(ticks)
+    return sim.get_stats()
+
+
+def _run(job):
+    return job[0], run_layout(*job)
+
+
+def aggregate(runs):
+    """Сводка прогонов одной карты."""
+    result = {'runs': len(runs)}
+    for name in COUNTERS:
+        values = [stats[name] for stats in runs]
+        result[name] = sum(values)
+        result[name + '_mean'] = statistics.fmean(values)
+        result[name + '_stdev'] = statistics.pstdev(values)
+    delivered = result['delivered']
+    result['mean_trip_ticks'] = (sum(stats['trip_ticks'] for stats in runs) / delivered
+                                 if delivered else None)
+    return result
+
+
+def evaluate(layouts, runs, ticks, seed=0, workers=None, batched=False, events=False, swept=False):
+    """Прогоняет каждую карту runs раз с зёрнами seed, seed+1, ..., сводка по картам."""
+    jobs = [(filename, seed + i, ticks, batched, events, swept)
+            for filename in layouts for i in range(runs)]
+    results = {filename: [] for filename in layouts}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # по нескольку прогонов на задачу, чтобы не платить за пересылку каждого
+        chunksize = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))
+        for filename, stats in pool.map(_run, jobs, chunksize=chunksize):
+            results[filename].append(stats)
+    return {filename: aggregate(stats) for filename, stats in results.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Оценка карт railway случайными прогонами")
+    parser.add_argument('layouts', nargs='+', help="карты, сохранённые save_state или export_json")
+    parser.add_argument('--runs', type=int, default=64, help="прогонов на карту")
+    parser.add_argument('--ticks', type=int, default=20000, help="тиков на прогон")
+    parser.add_argument('--seed', type=int, default=0, help="зерно первого прогона")
+    parser.add_argument('--workers', type=int, help="процессов, по умолчанию по числу ядер")
+    parser.add_argument('--batched', action='store_true', help="пакетное движение вагонов (numpy)")
+    parser.add_argument('--events', action='store_true', help="перемотка по событиям вместо тиков")
+    parser.add_argument('--swept', action='store_true', help="столкновения по пройденному пути")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    summary = evaluate(args.layouts, args.runs, args.ticks, args.seed, args.workers, args.batched,
+                       args.events, args.swept)
+    elapsed = time.perf_counter() - start
+    for filename, result in summary.items():
+        print(json.dumps(dict(layout=filename, ticks=args.ticks, **result)))
+    total_ticks = args.runs * args.ticks * len(args.layouts)
+    print("%d прогонов за %.1f с, %.0f тиков/с" % (args.runs * len(args.layouts), elapsed,
+                                                   total_ticks / elapsed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
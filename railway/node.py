@@ -1,36 +1,99 @@
-import pygame
 import math
+from operator import attrgetter
 from track import Track, CurvedTrack
+from direction import DIRECTIONS, ALL_DIRS, opposite
+from commands import SWITCH, SEMAPHORE
+
+NO_TRACKS = ()  # общий пустой список путей
+track_key = attrgetter('key')
 
 class Node:
-    def __init__(self, x, y):
+    __slots__ = ('x', 'y', 'index', 'outs', 'active_track_index', 'semaphore_states', 'blocked_dirs', 'blockers',
+                 'color', 'is_station', 'dir_tracks', 'track_count', 'degree', 'terminal', 'semaphores')
+
+    def __init__(self, x, y, index=0):
         self.x = x
         self.y = y
-        self.outs = {
-            (-1, 0): [],
-            (1, 0): [],
-            (0, -1): [],
-            (0, 1): []
-        }
-        self.active_track_index = {}  # Текущий активный путь в каждом направлении
-        self.semaphore_states = {}  # Состояния семафоров (True - зелёный, False - красный)
-        self.blocked_dirs = {}  # Каие напралления стрелок заблокированы поездами
+        self.index = index  # номер узла в RailGraph, x * grid_size_y + y
+        # построенные (включённые) пути по кодам направлений (см. direction.py)
+        self.outs = [NO_TRACKS, NO_TRACKS, NO_TRACKS, NO_TRACKS]
+        self.active_track_index = bytearray(4)  # Текущий активный путь в каждом направлении
+        self.semaphore_states = bytearray(b'\x01\x01\x01\x01')  # Состояния семафоров (1 - зелёный, 0 - красный)
+        self.blocked_dirs = 0  # Каие напралления стрелок заблокированы поездами (битовая маска)
+        self.blockers = [0, 0, 0, 0]  # сколько поездов блокирует стрелку в каждом направлении
         self.color = (0, 0, 0)  # Цвет узла
         self.is_station = False  # Является ли узел станцией
 
+        # Кэш включённых путей, пересчитывается в update_index при изменении путей
+        self.dir_tracks = [NO_TRACKS, NO_TRACKS, NO_TRACKS, NO_TRACKS]  # включённые пути по направлениям
+        self.track_count = 0  # сколько всего включённых путей
+        self.degree = 0  # в скольких направлениях есть включённые пути
+        self.terminal = False  # ровно одно направление с путями
+        self.semaphores = 0  # направления, в которых стоит семафор (битовая маска)
+
     def getCanvasX(self, cell_size):
         return self.x * cell_size + cell_size // 2
 
     def getCanvasY(self, cell_size):
         return self.y * cell_size + cell_size // 2
 
+    def clear_tracks(self):
+        """Убирает все пути из узла."""
+        for direction in ALL_DIRS:
+            self.outs[direction] = NO_TRACKS
+        self.update_index()
+
+    def add_track(self, direction, track):
+        """Добавляет путь в указанном направлении."""
+        # порядок путей не зависит от порядка постройки, от него зависят стрелки
+        self.outs[direction] = tuple(sorted(self.outs[direction] + (track,), key=track_key))
+
+    def remove_track(self, direction, track):
+        """Убирает путь в указанном направлении."""
+        self.outs[direction] = tuple(t for t in self.outs[direction] if t is not track) or NO_TRACKS
+
+    def update_index(self):
+        """Пересчитывает кэш включённых путей, вызывается при включении/выключении пути."""
+        self.track_count = 0
+        self.degree = 0
+        for direction in ALL_DIRS:
+            active_tracks = tuple(track for track in self.outs[direction] if track.enabled) or NO_TRACKS
+            self.dir_tracks[direction] = active_tracks
+            self.track_count += len(active_tracks)
+            if active_tracks:
+                self.degree += 1
+        self.terminal = self.degree == 1
+
+        # семафор ставится на дуге, если в обе стороны от узла ровно по одному пути
+        self.semaphores = 0
+        for direction in ALL_DIRS:
+            active_tracks = self.dir_tracks[direction]
+            opos_tracks = self.dir_tracks[opposite(direction)]
+            if (len(active_tracks) == 1 and len(opos_tracks) == 1
+                    and isinstance(active_tracks[0], CurvedTrack)):
+                self.semaphores |= 1 << direction
+
     def get_dir_tracks(self, direction):
-        """Получить список доступных треков по направлению"""
-        return [track for track in self.outs[direction] if track.enabled]
+        """Получить список доступных треков по направлению (не изменять!)"""
+        return self.dir_tracks[direction]
+
+    def block(self, dirs):
+        """Поезд проходит через узел по направлениям dirs (маска), стрелки не переключать."""
+        for direction in ALL_DIRS:
+            if dirs >> direction & 1:
+                self.blockers[direction] += 1
+        self.blocked_dirs |= dirs
+
+    def unblock(self, dirs):
+        """Поезд освободил направления dirs, заданные раньше в block."""
+        for direction in ALL_DIRS:
+            if dirs >> direction & 1:
+                self.blockers[direction] -= 1
+                if not self.blockers[direction]:
+                    self.blocked_dirs &= ~(1 << direction)
 
     def is_station_bisy(self):
-        for direction in self.outs:
-            active_tracks =  self.get_dir_tracks(direction)
+        for active_tracks in self.dir_tracks:
             if active_tracks:
                 track = active_tracks[0]
                 return track.bisy
@@ -38,18 +101,14 @@ class Node:
 
     def is_terminal(self):
         """Проверяет, является ли узел конечным (имеет ровно один активный исходящий путь)."""
-        active_directions = 0
-        for direction in self.outs:
-            if self.get_dir_tracks(direction):
-                active_directions += 1
-        return active_directions == 1
+        return self.terminal
 
     def get_active_track(self, direction):
         """Возвращает текущий активный путь в указанном направлении."""
-        if direction not in self.active_track_index:
-            self.active_track_index[direction] = 0
-        active_tracks = self.get_dir_tracks(direction)
+        active_tracks = self.dir_tracks[direction]
         if active_tracks:
+            if len(active_tracks) == 1:
+                return active_tracks[0]
             return active_tracks[self.active_track_index[direction] % len(active_tracks)]
         return None
 
@@ -57,91 +116,62 @@ class Node:
         """Переключает активный путь в указанном направлении."""
         active_tracks = self.get_dir_tracks(direction)
         if len(active_tracks) > 1:
-            self.active_track_index[direction] = (self.active_track_index.get(direction, 0) + 1) % len(active_tracks)
+            self.active_track_index[direction] = (self.active_track_index[direction] + 1) % len(active_tracks)
 
     def can_add_track(self, direction):
         """Проверяет, можно ли добавить путь в указанном направлении."""
         if self.is_station:
             # Для станции общее количество путей не должно превышать 1
-            total_tracks = 0
-            for direction in self.outs:
-                total_tracks += len(self.get_dir_tracks(direction))
-            return total_tracks < 1
+            return self.track_count < 1
         else:
             # Для обычного узла в указанном направлении не должно быть больше одного пути
-            return len(self.get_dir_tracks(direction)) < 2
-
-    def draw_arrow(self, screen, direction, cell_size):
-        """Рисует стрелку в указанном направлении."""
-        x, y = self.getCanvasX(cell_size), self.getCanvasY(cell_size)
-        track = self.get_active_track(direction)
-        dx, dy = track.get_vector_for_node(self)
-        end_x = x + dx * cell_size // 3
-        end_y = y + dy * cell_size // 3
-        color = (255, 0, 0)
-        if self.blocked_dirs.get(direction):
-            color = (200,200,200)
-        pygame.draw.line(screen, color, (x, y), (end_x, end_y), 4)
-
-    def draw_semaphore(self, screen, direction, cell_size):
-        """Рисует семафор в указанном направлении."""
-        dx, dy = direction
-        x, y = self.getCanvasX(cell_size), self.getCanvasY(cell_size)
-        semaphore_x = x + dx * cell_size // 8
-        semaphore_y = y + dy * cell_size // 8
-        color = (0, 255, 0) if self.semaphore_states.get(direction, True) else (255, 0, 0)
-        if self.blocked_dirs.get(direction):
-            color = (200,200,200)
-        pygame.draw.circle(screen, color, (semaphore_x, semaphore_y), 5)
-        pygame.draw.line(screen, color, (x, y), (semaphore_x, semaphore_y), 1)
+            return len(self.dir_tracks[direction]) < 2
 
     def has_semaphore(self, direction):
-        active_tracks = self.get_dir_tracks(direction)
-        if len(active_tracks) != 1:
-            return False
-
-        opos_tracks = self.get_dir_tracks((-direction[0], -direction[1]))
-        if len(opos_tracks) != 1:
-            return False
-
-        act_track = self.get_active_track(direction)
-        return isinstance(act_track, CurvedTrack)
+        return self.semaphores >> direction & 1
 
     def is_semaphore_open(self, direction):
-        return (not self.has_semaphore(direction)
-        or self.semaphore_states.get(direction, True))
+        return (not self.semaphores >> direction & 1
+        or self.semaphore_states[direction])
 
-    def handle_click(self, mouse_x, mouse_y, cell_size):
-        """Обрабатывает клик мыши в режиме управления."""
+    def click_commands(self, mouse_x, mouse_y, cell_size):
+        """Команды для симуляции от клика мыши в режиме управления."""
+        commands = []
         x, y = self.getCanvasX(cell_size), self.getCanvasY(cell_size)
-        for direction in self.outs:
-            if self.blocked_dirs.get(direction):
+        for direction in ALL_DIRS:
+            if self.blocked_dirs >> direction & 1:
                 continue
-            active_tracks = self.get_dir_tracks(direction)
+            dx, dy = DIRECTIONS[direction]
+            active_tracks = self.dir_tracks[direction]
             if len(active_tracks) > 1:
-                end_x = x + direction[0] * cell_size // 3
-                end_y = y + direction[1] * cell_size // 3
+                end_x = x + dx * cell_size // 3
+                end_y = y + dy * cell_size // 3
                 if math.hypot(mouse_x - end_x, mouse_y - end_y) < 20:
-                    self.toggle_active_track(direction)
+                    commands.append((SWITCH, self.x, self.y, direction))
             elif self.has_semaphore(direction):
-                semaphore_x = x + direction[0] * cell_size // 8
-                semaphore_y = y + direction[1] * cell_size // 8
+                semaphore_x = x + dx * cell_size // 8
+                semaphore_y = y + dy * cell_size // 8
                 if math.hypot(mouse_x - semaphore_x, mouse_y - semaphore_y) < 10:
-                    self.semaphore_states[direction] = not self.semaphore_states.get(direction, True)
-
-    def draw(self, screen, construction_mode, cell_size):
-        """Рисует узел, стрелки и семафоры."""
-        if self.is_station:
-            # Рисуем станцию
-            pygame.draw.circle(screen, self.color, (self.getCanvasX(cell_size), self.getCanvasY(cell_size)), 8)
-        elif self.is_terminal():
-            # Рисуем терминальный узел
-            pygame.draw.circle(screen, self.color, (self.getCanvasX(cell_size), self.getCanvasY(cell_size)), 5)
-
-        if not construction_mode:
-            for direction in self.outs:
-                active_tracks = self.get_dir_tracks(direction)
-                if len(active_tracks) > 1:
-                    self.draw_arrow(screen, direction, cell_size)
-                elif self.has_semaphore(direction):
-                    self.draw_semaphore(screen, direction, cell_size)
\ No newline at end of file
+                    commands.append((SEMAPHORE, self.x, self.y, direction))
+        return commands
+
+    def has_controls(self):
+        """Есть ли в узле стрелки или семафоры."""
+        if self.semaphores:
+            return True
+        for active_tracks in self.dir_tracks:
+            if len(active_tracks) > 1:
+                return True
+        return False
+
+    def get_controls_state(self):
+        """Всё, от чего зависит вид стрелок и семафоров узла."""
+        switches = tuple(self.active_track_index[direction] % len(active_tracks)
+                         for direction, active_tracks in enumerate(self.dir_tracks) if len(active_tracks) > 1)
+        return switches, bytes(self.semaphore_states), self.blocked_dirs
+
+    def get_controls_area(self, cell_size):
+        """Прямоугольник холста (x_min, y_min, x_max, y_max), в котором помещаются стрелки и семафоры узла."""
+        reach = cell_size // 3 + 5
+        x, y = self.getCanvasX(cell_size), self.getCanvasY(cell_size)
+        return x - reach, y - reach, x + reach, y + reach
@@ -0,0 +1,164 @@
+"""Замеры времени фаз кадра для игровых циклов.
+
+Цикл размечает кадр фазами:
+
+    profiler.begin_frame()
+    with profiler.phase('events'):
+        ...
+    profiler.end_frame()
+
+Фазы верхнего уровня попадают в trace со своим временем, вложенные
+(например, фазы тиков симуляции, которых за кадр бывает много)
+суммируются за кадр. Последние кадры показываются на экране (HUD с
+графиком времени кадра) и выгружаются в Chrome trace (chrome://tracing,
+Perfetto) или JSONL по кадру на строку.
+
+Лежит в railway (там его берут плоским импортом), game/ импортирует
+его как railway.profiler.
+"""
+import json
+import time
+from collections import deque
+
+try:
+    import pygame
+except ImportError:  # замеры работают и без дисплея
+    pygame = None
+
+HISTORY = 600  # сколько последних кадров хранить
+GRAPH_FRAMES = 240  # кадров на графике HUD
+TARGET_MS = 1000 / 60  # линия бюджета кадра на графике
+HUD_BG = (0, 0, 0)
+HUD_TEXT = (255, 255, 255)
+HUD_BAR = (80, 200, 80)
+HUD_SLOW = (230, 80, 60)
+HUD_LINE = (200, 200, 0)
+
+
+class Phase:
+    """Контекст замера одной фазы."""
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.profiler.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        profiler = self.profiler
+        duration = time.perf_counter() - self.start
+        profiler.depth -= 1
+        profiler.totals[self.name] = profiler.totals.get(self.name, 0.0) + duration
+        if not profiler.depth:
+            profiler.spans.append((self.name, self.start, duration))
+        return False
+
+
+class FrameProfiler:
+    """Время фаз по кадрам, HUD и выгрузка trace."""
+
+    def __init__(self):
+        self.visible = False  # показывать HUD
+        self.frames = deque(maxlen=HISTORY)  # (начало, длительность, фазы верхнего уровня, суммы фаз)
+        self.frame_start = None
+        self.spans = []
+        self.totals = {}
+        self.depth = 0
+        self.font = None
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+        self.spans = []
+        self.totals = {}
+
+    def end_frame(self):
+        if self.frame_start is None:
+            return
+        duration = time.perf_counter() - self.frame_start
+        self.frames.append((self.frame_start, duration, self.spans, self.totals))
+        self.frame_start = None
+
+    def toggle(self):
+        self.visible = not self.visible
+
+    def averages(self, frames=60):
+        """Средние за последние кадры: время кадра и фаз, мс."""
+        recent = list(self.frames)[-frames:]
+        if not recent:
+            return 0.0, {}
+        phases = {}
+        for _, _, _, totals in recent:
+            for name, duration in totals.items():
+                phases[name] = phases.get(name, 0.0) + duration
+        frame_ms = sum(duration for _, duration, _, _ in recent) * 1000 / len(recent)
+        return frame_ms, {name: total * 1000 / len(recent) for name, total in phases.items()}
+
+    def draw(self, screen):
+        """Рисует HUD в левом верхнем углу, возвращает его прямоугольник."""
+        if self.font is None:
+            self.font = pygame.font.Font(None, 18)
+        frame_ms, phases = self.averages()
+        lines = ["frame %.2f ms (%.0f fps)" % (frame_ms, 1000 / frame_ms if frame_ms else 0)]
+        lines += ["%-10s %6.2f ms" % (name, ms) for name, ms in phases.items()]
+
+        line_height = self.font.get_linesize()
+        graph_height = 60
+        width = GRAPH_FRAMES + 10
+        rect = pygame.Rect(0, 0, width, len(lines) * line_height + graph_height + 15)
+        screen.fill(HUD_BG, rect)
+        for i, line in enumerate(lines):
+            screen.blit(self.font.render(line, True, HUD_TEXT), (5, 5 + i * line_height))
+
+        # график: столбец на кадр, высота графика - два бюджета кадра
+        bottom = rect.bottom - 5
+        scale = graph_height / (TARGET_MS * 2)
+        recent = list(self.frames)[-GRAPH_FRAMES:]
+        for i, (_, duration, _, _) in enumerate(recent):
+            ms = duration * 1000
+            height = min(graph_height, max(1, int(ms * scale)))
+            color = HUD_SLOW if ms > TARGET_MS else HUD_BAR
+            pygame.draw.line(screen, color, (5 + i, bottom), (5 + i, bottom - height))
+        target_y = bottom - int(TARGET_MS * scale)
+        pygame.draw.line(screen, HUD_LINE, (5, target_y), (5 + GRAPH_FRAMES, target_y))
+        return rect
+
+    def dump(self, filename):
+        """Выгружает кадры: .jsonl - строка на кадр, иначе Chrome trace."""
+        frames = list(self.frames)
+        if not frames:
+            return
+        origin = frames[0][0]
+        with open(filename, 'w') as f:
+            if filename.endswith('.jsonl'):
+                for number, (start, duration, _, totals) in enumerate(frames):
+                    f.write(json.dumps({
+                        'frame': number,
+                        'start_ms': (start - origin) * 1000,
+                        'frame_ms': duration * 1000,
+                        'phases_ms': {name: total * 1000 for name, total in totals.items()},
+                    }) + '\n')
+            else:
+                json.dump({'traceEvents': self.trace_events(frames, origin)}, f)
+
+    @staticmethod
+    def trace_events(frames, origin):
+        events = []
+        for number, (start, duration, spans, totals) in enumerate(frames):
+            ts = (start - origin) * 1e6
+            events.append({'name': 'frame', 'ph': 'X', 'pid': 1, 'tid': 1,
+                           'ts': ts, 'dur': duration * 1e6, 'args': {'frame': number}})
+            for name, span_start, span_duration in spans:
+                events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': 1,
+                               'ts': (span_start - origin) * 1e6, 'dur': span_duration * 1e6})
+            # суммы всех фаз, включая вложенные, счётчиком на кадр
+            events.append({'name': 'phases_ms', 'ph': 'C', 'pid': 1, 'ts': ts,
+                           'args': {name: total * 1000 for name, total in totals.items()}})
+        return events
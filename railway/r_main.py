@@ -1,5 +1,15 @@
+import argparse
 from game import Game
 
 if __name__ == "__main__":
-    game = Game(grid_size_x=10, grid_size_y=6, cell_size=100)
-    game.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Railway Simulator")
+    parser.add_argument("--seed", type=int, help="зерно генератора, чтобы повторить карту")
+    parser.add_argument("--record", help="записать сеанс в файл для replay.py")
+    parser.add_argument("--size", default="10x6", help="размер карты в клетках, ШxВ")
+    parser.add_argument("--cell", type=int, default=100, help="размер клетки в пикселях при масштабе 1")
+    args = parser.parse_args()
+
+    grid_size_x, grid_size_y = map(int, args.size.lower().split("x"))
+    game = Game(grid_size_x=grid_size_x, grid_size_y=grid_size_y, cell_size=args.cell,
+                seed=args.seed, record=args.record)
+    game.run()
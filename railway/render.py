@@ -0,0 +1,210 @@
+"""Отрисовка модели railway в pygame.
+
+Модель (пути, узлы, поезда, чекпоинты) ничего не знает о pygame и
+работает без дисплея; всё рисование - здесь, по состоянию объектов
+модели. Координаты холста при sim.cell_size переводятся на экран
+камерой (camera.Camera).
+"""
+from bisect import bisect_left, bisect_right
+import pygame
+from track import CurvedTrack
+from direction import DIRECTIONS
+
+ARC_CACHE = 64  # сколько нарисованных дуг держать: на масштаб 4 четверти на 4 цвета
+arc_sprites = {}  # (цвет, радиус, толщина, углы) -> (дуга, сдвиг x, сдвиг y)
+
+
+def track_color(track, is_hovered, construction_mode):
+    """Цвет пути в зависимости от его состояния и наведения."""
+    if track.enabled:
+        return (255, 0, 0) if is_hovered and construction_mode else (200, 200, 200)
+    else:
+        return (255, 100, 100) if is_hovered else (240, 240, 240)
+
+
+def draw_track(screen, track, is_hovered, construction_mode, cell_size, camera):
+    if isinstance(track, CurvedTrack):
+        draw_curved_track(screen, track, is_hovered, construction_mode, cell_size, camera)
+        return
+    color = track_color(track, is_hovered, construction_mode)
+    width = camera.size(8 if track.enabled else 3)
+    g = track.get_geometry(cell_size)
+    # прямой путь всегда горизонтальный или вертикальный, рисуем его прямоугольником
+    # с теми же пикселями, что и толстая линия: pygame.draw.line теряет линию
+    # целиком, если её ось ушла за край окна, а край ещё виден
+    left, top = camera.to_screen(g.x_min, g.y_min)
+    right, bottom = camera.to_screen(g.x_max, g.y_max)
+    if track.node1.y == track.node2.y:
+        top -= (width - 1) // 2
+        bottom = top + width - 1
+    else:
+        left -= (width - 1) // 2
+        right = left + width - 1
+    # fill не обрезает прямоугольник с отрицательным углом, а сдвигает его в окно
+    rect = pygame.Rect(left, top, right - left + 1, bottom - top + 1).clip(screen.get_clip())
+    if rect:
+        screen.fill(color, rect)
+
+
+def draw_curved_track(screen, track, is_hovered, construction_mode, cell_size, camera):
+    color = track_color(track, is_hovered, construction_mode)
+    g = track.get_geometry(cell_size)
+
+    width = camera.size(8 if track.enabled else 3)
+    radius = camera.size(cell_size) + width //2
+
+    center_x, center_y = camera.to_screen(g.center_x, g.center_y)
+    image, dx, dy = arc_sprite(color, radius, width,
+                               min(g.start_angle, g.end_angle), max(g.start_angle, g.end_angle))
+    screen.blit(image, (center_x - radius + dx, center_y - radius + dy))
+
+
+def arc_sprite(color, radius, width, start_angle, end_angle):
+    """Дуга на прозрачной поверхности и её сдвиг от угла квадрата радиуса radius.
+
+    pygame.draw.arc растеризует дугу по-разному в зависимости от того, где
+    на поверхности она рисуется, и дуга, дорисованная в полосе после
+    прокрутки слоя, расходилась бы на пиксель с нарисованной до прокрутки.
+    Поэтому дуга рисуется один раз в одном месте и переносится blit, который
+    сдвигает картинку ровно.
+    """
+    key = (color, radius, width, start_angle, end_angle)
+    sprite = arc_sprites.get(key)
+    if sprite is None:
+        if len(arc_sprites) >= ARC_CACHE:
+            arc_sprites.clear()
+        # pygame.draw.arc задевает и пиксель за правым краем квадрата, отсюда запас
+        surface = pygame.Surface((radius * 2 + 2, radius * 2 + 2), pygame.SRCALPHA)
+        pygame.draw.arc(surface, color, (1, 1, radius * 2, radius * 2), start_angle, end_angle, width)
+        bounds = surface.get_bounding_rect()
+        sprite = arc_sprites[key] = (surface.subsurface(bounds).copy(), bounds.x - 1, bounds.y - 1)
+    return sprite
+
+
+def draw_arrow(screen, node, direction, cell_size, camera):
+    """Рисует стрелку узла в указанном направлении."""
+    x, y = node.getCanvasX(cell_size), node.getCanvasY(cell_size)
+    track = node.get_active_track(direction)
+    dx, dy = track.get_vector_for_node(node)
+    end_x = x + dx * cell_size // 3
+    end_y = y + dy * cell_size // 3
+    color = (255, 0, 0)
+    if node.blocked_dirs >> direction & 1:
+        color = (200,200,200)
+    pygame.draw.line(screen, color, camera.to_screen(x, y), camera.to_screen(end_x, end_y),
+                     camera.size(4))
+
+
+def draw_semaphore(screen, node, direction, cell_size, camera):
+    """Рисует семафор узла в указанном направлении."""
+    dx, dy = DIRECTIONS[direction]
+    x, y = node.getCanvasX(cell_size), node.getCanvasY(cell_size)
+    semaphore_x = x + dx * cell_size // 8
+    semaphore_y = y + dy * cell_size // 8
+    color = (0, 255, 0) if node.semaphore_states[direction] else (255, 0, 0)
+    if node.blocked_dirs >> direction & 1:
+        color = (200,200,200)
+    semaphore = camera.to_screen(semaphore_x, semaphore_y)
+    pygame.draw.circle(screen, color, semaphore, camera.size(5))
+    pygame.draw.line(screen, color, camera.to_screen(x, y), semaphore, 1)
+
+
+def draw_node(screen, node, construction_mode, cell_size, camera):
+    """Рисует узел, стрелки и семафоры."""
+    draw_marker(screen, node, cell_size, camera)
+    if not construction_mode:
+        draw_controls(screen, node, cell_size, camera)
+
+
+def draw_marker(screen, node, cell_size, camera):
+    """Рисует станцию или тупик, они меняются только вместе с путями."""
+    center = camera.to_screen(node.getCanvasX(cell_size), node.getCanvasY(cell_size))
+    if node.is_station:
+        # Рисуем станцию
+        pygame.draw.circle(screen, node.color, center, camera.size(8))
+    elif node.terminal:
+        # Рисуем терминальный узел
+        pygame.draw.circle(screen, node.color, center, camera.size(5))
+
+
+def draw_controls(screen, node, cell_size, camera):
+    """Рисует стрелки и семафоры узла."""
+    for direction, active_tracks in enumerate(node.dir_tracks):
+        if len(active_tracks) > 1:
+            draw_arrow(screen, node, direction, cell_size, camera)
+        elif node.semaphores >> direction & 1:
+            draw_semaphore(screen, node, direction, cell_size, camera)
+
+
+def draw_vagon(screen, vagon, cell_size, camera, alpha=1.0):
+    """Рисует вагон, если он в окне, возвращает закрашенный прямоугольник."""
+    pos = vagon.get_draw_position(cell_size, alpha)
+    if pos and camera.is_visible(*pos, margin=camera.size(8)):
+        return pygame.draw.circle(screen, vagon.color, camera.to_screen(*pos), camera.size(8))
+    return None
+
+
+def draw_train(screen, train, cell_size, camera, alpha=1.0):
+    """Рисует видимые вагоны поезда, возвращает закрашенные прямоугольники."""
+    if not train.is_active:
+        return []
+
+    rects = []
+    for vagon in train.vagons:
+        rect = draw_vagon(screen, vagon, cell_size, camera, alpha)
+        if rect:
+            rects.append(rect)
+    return rects
+
+
+def draw_train_pixels(screen, trains, cell_size, camera, alpha=1.0):
+    """Поезда на дальнем виде: экран делится на квадраты в четверть клетки,
+    квадрат с вагонами закрашивается цветом одного из них. Кружок на вагон
+    там меньше пикселя, а квадратов не больше, чем помещается на экране.
+    Возвращает закрашенные прямоугольники."""
+    block = max(2, camera.size(cell_size) // 4)
+    width, height = camera.width, camera.height
+    cells = {}
+    for train in trains:
+        if not train.is_active:
+            continue
+        for vagon in train.vagons:
+            pos = vagon.get_draw_position(cell_size, alpha)
+            if pos:
+                x, y = camera.to_screen(*pos)
+                if 0 <= x < width and 0 <= y < height:
+                    cells[(x // block, y // block)] = vagon.color
+    return [screen.fill(color, (bx * block, by * block, block, block))
+            for (bx, by), color in cells.items()]
+
+
+def draw_checkpoints(screen, crosses, rect, camera):
+    """Рисует пустые чекпоинты внутри прямоугольника экрана, они меняются только с картой."""
+    color = (255,255,255);
+    # color = (10,10,10);
+    x_min, y_min, x_max, y_max = camera.world_rect(rect)
+    margin = 3 + 1 / camera.scale  # радиус кружка на холсте и пиксель округления
+    radius = camera.size(3)
+    for matrix in crosses.matrixes:
+        xs = matrix.xs[bisect_left(matrix.xs, x_min - margin):bisect_right(matrix.xs, x_max + margin)]
+        ys = matrix.ys[bisect_left(matrix.ys, y_min - margin):bisect_right(matrix.ys, y_max + margin)]
+        for x in xs:
+            for y in ys:
+                pygame.draw.circle(screen, color, camera.to_screen(x, y), radius)
+
+
+def draw_crosses(screen, crosses, camera, show_occupied=True):
+    """Рисует видимые занятые чекпоинты (если show_occupied) и аварии,
+    возвращает изменённые прямоугольники."""
+    rects = []
+    for matrix in crosses.matrixes:
+        radius = camera.size(3)
+        for x, y, train in matrix.occupied if show_occupied else ():
+            if camera.is_visible(x, y, radius):
+                rects.append(pygame.draw.circle(screen, train.color, camera.to_screen(x, y), radius))
+        radius = camera.size(12)
+        for (x, y) in matrix.crashes:
+            if camera.is_visible(x, y, radius):
+                color = (80, 10, 10);
+                rects.append(pygame.draw.circle(screen, color, camera.to_screen(x, y), radius))
+    return rects
@@ -0,0 +1,46 @@
+"""Повтор записанного сеанса без окна с максимальной скоростью.
+
+Сеанс записывается так: python r_main.py --record session.rwr
+Повтор: python replay.py session.rwr [--batched]
+
+Печатает скорость повтора и сверяет хэш итогового состояния с записанным,
+при расхождении завершается с кодом 1.
+"""
+import argparse
+import sys
+import time
+from simulation import Simulation
+from commands import Session
+
+
+def replay(session, batched=False):
+    """Прогоняет сеанс на новой симуляции, возвращает её."""
+    sim = Simulation(session.grid_size_x, session.grid_size_y, session.cell_size,
+                     batched=batched, seed=session.seed)
+    for tick, *command in session.commands:
+        sim.step(tick - sim.ticks)
+        sim.execute(command)
+    sim.step(session.ticks - sim.ticks)
+    return sim
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Повтор записанного сеанса railway")
+    parser.add_argument("session", help="файл сеанса")
+    parser.add_argument("--batched", action="store_true", help="пакетное движение вагонов (numpy)")
+    args = parser.parse_args(argv)
+
+    session = Session.load(args.session)
+    start = time.perf_counter()
+    sim = replay(session, args.batched)
+    elapsed = time.perf_counter() - start
+
+    ok = sim.state_hash() == session.state_hash
+    print("тиков %d, команд %d, %.2f с, %.0f тиков/с, поездов %d, хэш %s"
+          % (sim.ticks, len(session.commands), elapsed, sim.ticks / elapsed if elapsed else 0,
+             sim.tr_started, "совпал" if ok else "НЕ СОВПАЛ"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
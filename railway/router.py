@@ -0,0 +1,160 @@
+import heapq
+from graph import SLOT_TRACKS
+from direction import opposite
+
+INF = float('inf')
+
+
+class Router:
+    """Маршруты к станциям по графу состояний (узел, направление выезда).
+
+    Поезд, выезжающий из узла в направлении d, выбирает стрелкой один из
+    путей node.dir_tracks[d] и въезжает в соседний узел с направлением e,
+    откуда может ехать дальше только в opposite(e). Для каждого цвета
+    станции обратным Дейкстрой считается время до станции и путь, на
+    который надо поставить стрелку в каждом состоянии. Включение пути
+    только укорачивает маршруты и досчитывается от его концов, выключение
+    пересчитывает только цвета, чьи маршруты через него шли. Таблицы
+    строятся лениво, при первом запросе после загрузки карты.
+
+    Состояние - слот RailGraph, поиск идёт по его массивам, таблицы -
+    плоские списки по номеру состояния.
+
+    Семафоры не учитываются: они переключаются игроком на ходу.
+    """
+
+    def __init__(self, sim):
+        self.sim = sim
+        self.valid = False  # таблицы построены для текущих станций
+        self.stations = {}  # цвет -> станция
+        self.dist = {}  # цвет -> [время до станции по состоянию]
+        self.next = {}  # цвет -> [путь, на который ставить стрелку, по состоянию]
+        self.uses = {}  # цвет -> {путь: в скольких состояниях он следующий}
+
+    def state(self, node, direction):
+        return node.index * 4 + direction
+
+    def invalidate(self):
+        """Сменились станции (загрузка карты), всё строится заново при запросе."""
+        self.valid = False
+
+    def rebuild(self):
+        self.stations = {station.color: station for station in self.sim.stations}
+        for color in self.stations:
+            self.rebuild_color(color)
+        self.valid = True
+
+    def rebuild_color(self, color):
+        slots = self.sim.graph.slots
+        self.dist[color] = [INF] * slots
+        self.next[color] = [None] * slots
+        self.uses[color] = {}
+        station = self.stations[color]
+        heap = []
+        # у станции не больше одного пути, поезд въезжает по нему в любом направлении
+        for direction in range(4):
+            self.relax_slot(color, heap, self.state(station, direction), 0.0)
+        self.propagate(color, heap)
+
+    def relax_slot(self, color, heap, slot, dist):
+        """Предлагает состояния, въезжающие в узел слота по его путям."""
+        first = slot * SLOT_TRACKS
+        for edge in range(first, first + self.sim.graph.count[slot]):
+            self.relax(color, heap, edge, dist)
+
+    def relax(self, color, heap, edge, node_dist):
+        """Предлагает состояние на другом конце ребра, въезжающее по нему в узел ребра."""
+        graph = self.sim.graph
+        state = graph.far[edge]
+        dist = node_dist + graph.cost[edge]
+        dists = self.dist[color]
+        if dist < dists[state]:
+            dists[state] = dist
+            self.set_next(color, state, graph.tracks[edge])
+            heapq.heappush(heap, (dist, state))
+
+    def set_next(self, color, state, track):
+        nexts = self.next[color]
+        uses = self.uses[color]
+        old = nexts[state]
+        if old is not None:
+            uses[old] -= 1
+            if not uses[old]:
+                del uses[old]
+        nexts[state] = track
+        uses[track] = uses.get(track, 0) + 1
+
+    def propagate(self, color, heap):
+        """Дейкстра назад по графу: кто может въехать в узел так, чтобы выехать в direction."""
+        dists = self.dist[color]
+        while heap:
+            dist, state = heapq.heappop(heap)
+            if dist > dists[state]:
+                continue
+            # въезжают в узел с направлением opposite(direction), это соседний слот
+            self.relax_slot(color, heap, state ^ 1, dist)
+
+    def track_enabled(self, track):
+        """Включили путь: маршруты могут только укоротиться, досчитываем от его концов."""
+        if not self.valid:
+            return
+        graph = self.sim.graph
+        for color, station in self.stations.items():
+            heap = []
+            dists = self.dist[color]
+            for node in (track.node1, track.node2):
+                edge = graph.edge(node, track)
+                if node is station:
+                    self.relax(color, heap, edge, 0.0)
+                else:
+                    state = self.state(node, opposite(track.get_exit_direction(node)))
+                    if dists[state] < INF:
+                        self.relax(color, heap, edge, dists[state])
+            self.propagate(color, heap)
+
+    def track_disabled(self, track):
+        """Выключили путь: пересчитываем только цвета, чьи маршруты через него шли."""
+        if not self.valid:
+            return
+        for color in self.stations:
+            if track in self.uses[color]:
+                self.rebuild_color(color)
+
+    def next_track(self, node, direction, color):
+        """Путь, на который ставить стрелку при выезде из node в direction к станции color."""
+        if not self.valid:
+            self.rebuild()
+        nexts = self.next.get(color)
+        return nexts[node.index * 4 + direction] if nexts else None
+
+    def distance(self, node, direction, color):
+        """Время до станции color (в проездах прямого пути) или None, если не доехать."""
+        if not self.valid:
+            self.rebuild()
+        dists = self.dist.get(color)
+        if not dists:
+            return None
+        dist = dists[node.index * 4 + direction]
+        return dist if dist < INF else None
+
+    def suggest(self, vagon, color):
+        """Положения стрелок узла, к которому едет вагон: [(узел, направление, индекс пути)].
+
+        Сходящуюся стрелку ставим на путь вагона, расходящуюся - на маршрут к станции.
+        """
+        track = vagon.current_track
+        node = vagon.end_node
+        if not track or not node:
+            return []
+        entry = track.get_exit_direction(node)
+        settings = []
+        tracks = node.dir_tracks[entry]
+        if len(tracks) > 1 and track in tracks:
+            settings.append((node, entry, tracks.index(track)))
+        exit_direction = opposite(entry)
+        tracks = node.dir_tracks[exit_direction]
+        if len(tracks) > 1:
+            route = self.next_track(node, exit_direction, color)
+            if route in tracks:
+                settings.append((node, exit_direction, tracks.index(route)))
+        return settings
@@ -0,0 +1,497 @@
+import hashlib
+import json
+import math
+import random
+from contextlib import nullcontext
+from node import Node
+from track import Track, CurvedTrack, TRACK_KINDS
+from train import TrainPool, T_CRAFT
+from crosses import Crosses
+from kinematics import BatchKinematics
+from router import Router
+from graph import RailGraph
+from fastforward import FastForward
+from commands import TOGGLE_TRACK, SWITCH, SEMAPHORE, SPAWN_DRAISINE, AUTO_SWITCH
+import snapshot
+
+TICKS_PER_SECOND = 60  # тиков симуляции за секунду игрового времени
+VIRTUAL_CACHE = 256  # сколько выключенных путей держать, чтобы наведение не пересоздавало их
+NO_PHASE = nullcontext()
+EMPTY_STATS = {'delivered': 0, 'crashed': 0, 'reversals': 0, 'trip_ticks': 0}
+
+
+def no_phase(name):
+    """Замена profiler.phase, когда замеры выключены."""
+    return NO_PHASE
+
+
+class Simulation:
+    """Модель железной дороги без отрисовки: пути, станции, поезда и аварии.
+
+    Не зависит от pygame, поэтому может крутиться без дисплея
+    с любой скоростью через step(n). Все случайные решения берутся
+    из своего генератора с зерном seed, поэтому при тех же командах
+    игрока (execute) симуляция повторяется тик в тик.
+    """
+
+    def __init__(self, grid_size_x, grid_size_y, cell_size=100, batched=False, seed=None,
+                 swept=False):
+        # без зерна берём случайное, но запоминаем, чтобы сеанс можно было повторить
+        self.seed = seed if seed is not None else random.getrandbits(63)
+        self.random = random.Random(self.seed)
+        self.commands = []  # команды игрока с номером тика, см. commands.py
+        self.grid_size_x = grid_size_x
+        self.grid_size_y = grid_size_y
+        self.cell_size = cell_size  # нужен для координат чекпоинтов аварий
+        self.nodes = [[Node(x, y, x * grid_size_y + y) for y in range(grid_size_y)]
+                      for x in range(grid_size_x)]
+        self.graph = RailGraph(grid_size_x * grid_size_y)  # смежность путей для Router
+        self.crosses = Crosses(self.nodes, cell_size)
+        # столкновения по всему пройденному за тик пути, а не по точкам вагонов
+        self.crosses.swept = swept
+        self.tracks = {}  # построенные пути по ключу (x, y, вид), см. TRACK_KINDS
+        self.virtual = {}  # недавно нужные выключенные пути, чтобы не терять их identity
+        self.trains = []
+        self.retired = []  # ушедшие за тик поезда, их пути освобождаются в начале следующего
+        self.pool = TrainPool()  # ушедшие поезда для новых, см. add_train
+        self.stations = []
+        self.colors = [
+            (255, 0, 0),  # Красный
+            (0, 255, 0),  # Зелёный
+            (0, 0, 255),  # Синий
+            (255, 255, 0),  # Жёлтый
+            (255, 0, 255),  # Пурпурный
+            (0, 255, 255),  # Голубой
+            (128, 0, 128),  # Фиолетовый
+            (255, 165, 0)  # Оранжевый
+        ]
+        self.router = Router(self)  # маршруты к станциям, считаются при первом запросе
+        self.auto_switch = False  # ставить стрелки перед поездами по маршруту к их станции
+        self.init_stations()  # Инициализация станций
+        self.tr_started = 0  # обшее число поездов
+        self.ticks = 0  # число прошедших тиков симуляции
+        self.stats = dict(EMPTY_STATS)  # итоги ушедших с карты поездов, см. get_stats
+        # пакетное движение вагонов на numpy, для карт с тысячами поездов
+        self.kinematics = BatchKinematics(cell_size) if batched else None
+        self.profiler = None  # FrameProfiler, если нужны замеры фаз тика
+
+    def init_stations(self):
+        """Выбирает 8 случайных узлов по периметру и назначает им цвета."""
+        perimeter_nodes = []
+
+        # Собираем узлы по периметру
+        for x in range(self.grid_size_x):
+            for y in range(self.grid_size_y):
+                if x == 0 or x == self.grid_size_x - 1 or y == 0 or y == self.grid_size_y - 1:
+                    perimeter_nodes.append(self.nodes[x][y])
+
+        # Выбираем 8 случайных узлов из периметра
+        self.stations = self.random.sample(perimeter_nodes, 8)
+
+        for i, node in enumerate(self.stations):
+            node.color = self.colors[i]  # Назначаем уникальный цвет
+            node.is_station = True  # Помечаем узел как станцию
+            good_tracks = []
+            for track in self.node_tracks(node):
+                oth_node = track.get_other_node(node)
+                x, y = oth_node.x, oth_node.y
+                if (x > 0 and x < self.grid_size_x - 1
+                and y>0 and  y < self.grid_size_y - 1):
+                    good_tracks.append(track)
+            track = self.random.choice(good_tracks)
+            self.set_track_enabled(track, True)
+            track.blocked = True
+
+    def collect_stations(self):
+        """Собирает станции после загрузки."""
+        # станции в порядке цветов, от этого зависит порядок их открытия
+        self.stations = [node for row in self.nodes for node in row if node.is_station]
+        self.stations.sort(key=lambda node: self.colors.index(node.color)
+                           if node.color in self.colors else len(self.colors))
+        self.router.invalidate()
+
+    def make_track(self, key):
+        """Создаёт путь по ключу, в узлы он попадает только при включении."""
+        x, y, kind = key
+        dx, dy, direction = TRACK_KINDS[kind]
+        node1, node2 = self.nodes[x][y], self.nodes[x + dx][y + dy]
+        if direction:
+            return CurvedTrack(node1, node2, direction)
+        return Track(node1, node2)
+
+    def get_track(self, key, keep=False):
+        """Построенный путь по ключу или виртуальный кандидат на его месте.
+
+        Кандидаты создаются по требованию (наведение, отрисовка, включение).
+        keep=True запоминает кандидата, чтобы при повторном запросе вернулся
+        тот же объект, например путь под курсором.
+        """
+        track = self.tracks.get(key) or self.virtual.get(key)
+        if track is None:
+            track = self.make_track(key)
+            if keep:
+                if len(self.virtual) >= VIRTUAL_CACHE:
+                    self.virtual.clear()
+                self.virtual[key] = track
+        return track
+
+    def is_valid_key(self, key):
+        x, y, kind = key
+        dx, dy, _ = TRACK_KINDS[kind]
+        return (0 <= x < self.grid_size_x and 0 <= y < self.grid_size_y
+                and 0 <= x + dx < self.grid_size_x and 0 <= y + dy < self.grid_size_y)
+
+    def candidate_keys(self, x_min, y_min, x_max, y_max):
+        """Ключи всех возможных путей, задевающих прямоугольник в координатах сетки."""
+        for x in range(max(0, math.ceil(x_min) - 1), min(self.grid_size_x - 1, math.floor(x_max)) + 1):
+            for y in range(max(0, math.ceil(y_min) - 1), min(self.grid_size_y - 1, math.floor(y_max) + 1) + 1):
+                for kind, (dx, dy, _) in enumerate(TRACK_KINDS):
+                    key = (x, y, kind)
+                    if (x + dx >= x_min and min(y, y + dy) <= y_max and max(y, y + dy) >= y_min
+                            and self.is_valid_key(key)):
+                        yield key
+
+    def node_tracks(self, node):
+        """Все возможные пути узла (построенные и кандидаты) по направлениям выезда."""
+        tracks = [self.get_track(key) for key in self.candidate_keys(node.x, node.y, node.x, node.y)]
+        tracks = [track for track in tracks if node in (track.node1, track.node2)]
+        tracks.sort(key=lambda track: track.get_exit_direction(node))
+        return tracks
+
+    def set_track_enabled(self, track, enabled):
+        """Включает/выключает путь и переносит его между построенными и кандидатами."""
+        track.set_enabled(enabled)
+        self.register_track(track)
+
+    def toggle_track(self, track):
+        """Переключает путь, если это возможно (см. Track.toggle)."""
+        track.toggle()
+        self.register_track(track)
+
+    def register_track(self, track):
+        self.graph.update_node(track.node1)
+        self.graph.update_node(track.node2)
+        if track.enabled:
+            if self.tracks.get(track.key) is not track:
+                self.tracks[track.key] = track
+                self.virtual.pop(track.key, None)
+                self.router.track_enabled(track)
+        elif self.tracks.pop(track.key, None) is not None:
+            self.virtual[track.key] = track
+            self.router.track_disabled(track)
+
+    def save_state(self, filename="save.rws", construction_mode=True):
+        """Сохраняет состояние игры в двоичный снимок, см. snapshot.py."""
+        snapshot.save_snapshot(self, filename, construction_mode)
+
+    def export_json(self, filename="save.json", construction_mode=True):
+        """Сохраняет карту в JSON для отладки (без положения вагонов)."""
+        data = {
+            "nodes": [],
+            "tracks": [],
+            "trains": [],
+            "construction_mode": construction_mode
+        }
+
+        # Сохраняем узлы
+        for row in self.nodes:
+            for node in row:
+                node_data = {
+                    "x": node.x,
+                    "y": node.y,
+                    "color": node.color,
+                    "is_station": node.is_station
+                }
+                data["nodes"].append(node_data)
+
+        # Сохраняем пути (выключенные - виртуальные, их не сохраняем)
+        for track in self.tracks.values():
+            track_data = {
+                "node1": [track.node1.x, track.node1.y],
+                "node2": [track.node2.x, track.node2.y],
+                "enabled": track.enabled,
+                "type": "CurvedTrack" if isinstance(track, CurvedTrack) else "Track",
+                "direction": track.direction if isinstance(track, CurvedTrack) else ''
+            }
+            data["tracks"].append(track_data)
+
+        # Сохраняем поезда
+        for train in self.trains:
+            train_data = {
+                "start_node": [train.start_node.x, train.start_node.y],
+                "color": train.color,
+                "is_active": train.is_active
+            }
+            data["trains"].append(train_data)
+
+        # Записываем данные в файл
+        with open(filename, "w") as f:
+            json.dump(data, f, indent=4)
+
+    def load_state(self, filename="save.rws"):
+        """Загружает состояние игры из снимка или JSON, возвращает прочитанные данные."""
+        if snapshot.is_snapshot(filename):
+            return {"construction_mode": snapshot.load_snapshot(self, filename)}
+        return self.import_json(filename)
+
+    def import_json(self, filename="save.json"):
+        """Загружает карту из JSON, сохранённого export_json."""
+        try:
+            with open(filename, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None  # Файл не существует
+
+        # Восстанавливаем узлы
+        for node_data in data["nodes"]:
+            x, y = node_data["x"], node_data["y"]
+            node = self.nodes[x][y]
+            node.color = tuple(node_data["color"])
+            node.is_station = node_data["is_station"]
+
+        self.collect_stations()
+
+        # Восстанавливаем пути, старые убираем из узлов
+        self.release_trains()
+        self.tracks.clear()
+        self.virtual.clear()
+        self.graph.clear()
+        for row in self.nodes:
+            for node in row:
+                node.clear_tracks()
+        for track_data in data["tracks"]:
+            if not track_data["enabled"]:
+                continue  # старые сохранения содержат и все выключенные пути
+            node1 = self.nodes[track_data["node1"][0]][track_data["node1"][1]]
+            node2 = self.nodes[track_data["node2"][0]][track_data["node2"][1]]
+            if track_data["type"] == "CurvedTrack":
+                track = CurvedTrack(node1, node2, track_data["direction"])
+            else:
+                track = Track(node1, node2)
+            self.set_track_enabled(track, True)
+
+        # Восстанавливаем поезда
+        for train_data in data["trains"]:
+            start_node = self.nodes[train_data["start_node"][0]][train_data["start_node"][1]]
+            train = self.pool.take(start_node, tuple(train_data["color"]))
+            train.is_active = train_data["is_active"]
+            self.trains.append(train)
+
+        return data
+
+    def execute(self, command):
+        """Выполняет команду игрока и записывает её с текущим тиком."""
+        self.commands.append((self.ticks,) + tuple(command))
+        code, a, b, c = command
+        if code == TOGGLE_TRACK:
+            self.toggle_track(self.get_track((a, b, c)))
+        elif code == SWITCH:
+            self.nodes[a][b].toggle_active_track(c)
+        elif code == SEMAPHORE:
+            self.nodes[a][b].semaphore_states[c] ^= 1
+        elif code == SPAWN_DRAISINE:
+            self.startCraftTrain(self.nodes[a][b])
+        elif code == AUTO_SWITCH:
+            self.auto_switch = bool(a)
+        else:
+            raise ValueError("неизвестная команда %r" % (command,))
+
+    def state_hash(self):
+        """Хэш всего, что влияет на дальнейшую симуляцию, для сверки повторов."""
+        nodes = {node for track in self.tracks.values() for node in (track.node1, track.node2)}
+        state = (
+            self.ticks, self.tr_started,
+            sorted((key, track.blocked) for key, track in self.tracks.items()),
+            sorted((node.x, node.y, bytes(node.active_track_index), bytes(node.semaphore_states))
+                   for node in nodes),
+            [(train.color, train.t_type, train.is_active, train.is_crached,
+              [(vagon.current_track.key if vagon.current_track else None,
+                vagon.start_node and (vagon.start_node.x, vagon.start_node.y),
+                float(vagon.progress), vagon.is_active, vagon.is_head, vagon.is_pre_tail)
+               for vagon in train.vagons])
+             for train in self.trains],
+            [sorted(matrix.crashes) for matrix in self.crosses.matrixes],
+        )
+        return hashlib.md5(repr(state).encode()).digest()
+
+    def add_train(self, train):
+        train.started = self.ticks
+        self.trains.append(train)
+        if self.kinematics:
+            self.kinematics.invalidate()
+
+    def finish_train(self, train):
+        """Поезд ушёл с карты: доехал или разбился."""
+        if train.is_crached:
+            self.stats['crashed'] += 1
+        else:
+            self.stats['delivered'] += 1
+            self.stats['trip_ticks'] += self.ticks - train.started
+        self.stats['reversals'] += train.reversals
+
+    def get_stats(self):
+        """Доставки, аварии, развороты (с поездами на карте) и среднее время поездки в тиках."""
+        stats = dict(self.stats)
+        stats['reversals'] += sum(train.reversals for train in self.trains)
+        stats['mean_trip_ticks'] = stats['trip_ticks'] / stats['delivered'] if stats['delivered'] else None
+        return stats
+
+    def release_trains(self):
+        """Убирает все поезда с карты вместе с занятыми ими путями и стрелками."""
+        for train in self.trains + self.retired:
+            train.release_occupancy()
+            self.pool.give(train)
+        self.trains.clear()
+        self.retired.clear()
+        if self.kinematics:
+            self.kinematics.invalidate()
+
+    def reset_traffic(self):
+        """Убирает поезда и аварии, карта остаётся, как для новой игры."""
+        self.release_trains()
+        for matrix in self.crosses.matrixes:
+            matrix.crashes.clear()
+        self.crosses.clear()
+        self.tr_started = 0
+        self.ticks = 0
+        self.stats = dict(EMPTY_STATS)
+        # снимок восстанавливает и генератор, новая игра начинается с зерна симуляции
+        self.random.seed(self.seed)
+
+    def route_trains(self):
+        """Ставит стрелки узлов, к которым едут поезда, по маршруту к их станциям.
+
+        Стрелки, через которые сейчас проезжает другой поезд, не трогаем.
+        """
+        for train in self.trains:
+            if train.t_type == T_CRAFT:
+                continue  # дрезине всё равно, на какую станцию
+            for vagon in train.vagons:
+                if vagon.is_head and vagon.is_active:
+                    for node, direction, index in self.router.suggest(vagon, train.color):
+                        if not node.blocked_dirs >> direction & 1:
+                            node.active_track_index[direction] = index
+                    break
+
+    def startCraftTrain(self,node):
+        train_color = (80,80,20)
+        self.add_train(self.pool.take(node, train_color, 2, T_CRAFT))
+
+    # Запустить очередной случайны поезд
+    def startRandomNexrTrain(self):
+        max_statuin_cnt = self.tr_started // 5 + 2
+        colors = []
+        stations = []
+        cnt = 0
+        for node in self.stations:
+            if cnt>=max_statuin_cnt:
+                break;
+            stations.append(node)
+            colors.append(node.color)
+            cnt += 1
+
+        cur_station = self.random.choice(stations)
+        if cur_station.is_station_bisy():
+            return
+
+        available_colors = [color for color in colors if color != cur_station.color]
+        train_color = self.random.choice(available_colors)
+        self.add_train(self.pool.take(cur_station, train_color, self.random.randint(2, 5)))
+        self.tr_started += 1
+
+    def step(self, n=1):
+        """Продвигает симуляцию на n тиков."""
+        for _ in range(n):
+            self.tick()
+
+    def fast_forward(self, n):
+        """Продвигает симуляцию на n тиков по событиям, результат как у step(n).
+
+        Быстрее step, когда поездов немного и они редко встречаются; где
+        поезда постоянно рядом или разворачиваются, идёт обычными тиками
+        и не быстрее step, см. fastforward.py. Команды игрока между тиками
+        не выполняются.
+        """
+        FastForward(self).run(n)
+
+    def tick(self):
+        """Один тик: запуск поездов, движение, блокировки стрелок и аварии.
+
+        Фазы идут в порядке spawn, routing, reset, kinematics, trains, crosses.
+        Аварии ищутся одним проходом после движения всех поездов, а не после
+        каждого: столкновение останавливает только поезда, уже прошедшие через
+        карту чекпоинтов, и не освобождает их путей, поэтому результат тот же,
+        что при поочерёдной проверке. На этом порядке держатся замеры фаз,
+        поиск по пройденному пути (Crosses.sweep_trains) и fastforward.
+        """
+        phase = self.profiler.phase if self.profiler else no_phase
+
+        with phase('spawn'):
+            self.spawn()
+
+        if self.auto_switch:
+            with phase('routing'):
+                self.route_trains()
+
+        # занятость путей и стрелок меняется, только когда вагоны въезжают на пути
+        # и съезжают с них (Train.occupy/release), здесь освобождаем ушедшие поезда
+        with phase('reset'):
+            self.release_retired()
+
+        # поезда без событий уже сдвинуты пакетно, остальные считаем по вагонам
+        fallback = None
+        if self.kinematics:
+            with phase('kinematics'):
+                fallback = self.kinematics.step(self.trains)
+
+        with phase('trains'):
+            # ушедшие поезда выбрасываются из списка за один проход
+            alive = []
+            for train in self.trains:
+                if fallback is None or train in fallback:
+                    if not self.update_train(train):
+                        continue
+                    if self.kinematics:
+                        self.kinematics.refresh(train)
+                alive.append(train)
+            self.trains[:] = alive
+
+        # аварии задевают только поезда, уже прошедшие через карту чекпоинтов,
+        # поэтому их можно искать после движения всех поездов
+        with phase('crosses'):
+            self.crosses.clear()
+            self.crosses.add_trains(self.trains)
+
+        self.ticks += 1
+
+    def spawn_chance(self):
+        """Вероятность выпуска нового поезда на тике, пока на карте есть поезда."""
+        return 0.001 / (len(self.trains)+1)
+
+    def spawn(self):
+        if not self.trains or self.random.random() < self.spawn_chance():
+            self.startRandomNexrTrain()
+
+    def release_retired(self):
+        """Освобождает пути поездов, ушедших с карты на прошлом тике."""
+        for train in self.retired:
+            train.release_occupancy()
+            self.pool.give(train)
+        self.retired.clear()
+
+    def update_train(self, train):
+        """Двигает поезд на тик. Возвращает, остался ли поезд на карте,
+        ушедший вызывающий сам выбрасывает из self.trains."""
+        was_active = train.is_active
+        train.update(self.nodes)
+        if not train.is_active:
+            self.finish_train(train)
+            if was_active:
+                # доехавший поезд держит пути до конца тика, как стоял на них
+                self.retired.append(train)
+            else:
+                train.release_occupancy()  # разбился на прошлом тике
+                self.pool.give(train)
+            return False
+        train.update_positions(self.cell_size)
+        return True
@@ -0,0 +1,306 @@
+"""Двоичный снимок состояния railway.
+
+Файл - заголовок и упакованные массивы, в порядке записи:
+
+* флаги узлов, по байту на узел: бит 0 - станция, биты 4..7 - закрытые семафоры;
+* цвета узлов, по 3 байта;
+* положения стрелок (active_track_index), по 4 байта на узел;
+* битовые множества включённых и заблокированных путей, бит на ключ пути;
+* места аварий в чекпоинтах;
+* итоги ушедших поездов (sim.stats) и состояние генератора sim.random;
+* записи поездов и вагонов, сначала sim.trains, потом sim.retired.
+
+Узлы идут в порядке sim.nodes[x][y], номер узла x * grid_size_y + y,
+номер пути в битовом множестве - номер узла * len(TRACK_KINDS) + вид.
+Файл читается через mmap, а нулевые участки массивов пропускаются
+поиском регулярным выражением, поэтому загрузка зависит от числа
+построенных путей и поездов, а не от размера карты.
+
+Снимок продолжает прогон точно: загруженная симуляция дальше идёт тик
+в тик как сохранённая (те же поезда, итоги и случайные числа).
+Simulation.reset_traffic заново сеет генератор, так прогоны montecarlo
+по одной карте с разными зёрнами остаются разными.
+"""
+import mmap
+import re
+import struct
+from track import TRACK_KINDS
+
+MAGIC = b'RWSN'
+VERSION = 2
+
+# магия, версия, режим конструирования, флаги, размер сетки, запущено поездов, тиков,
+# аварий, поездов, вагонов
+HEADER = struct.Struct('<4sHBBIIIQIII')
+# итоги: доставлено, разбито, разворотов, тиков в пути доставленных
+STATS = struct.Struct('<QQQQ')
+# состояние random.Random (getstate): 624 слова и позиция, есть ли gauss_next и он сам
+RANDOM = struct.Struct('<625IBd')
+# номер матрицы чекпоинтов и координаты аварии
+CRASH = struct.Struct('<Bii')
+# узел старта, цвет, тип, флаги, число вагонов, тик выезда, разворотов
+TRAIN = struct.Struct('<ii3BBBHQI')
+# текущий, начальный и конечный узлы, ключ пути, флаги, прогресс
+VAGON = struct.Struct('<iiiiiiiiBBd')
+
+STATION = 1
+SEMAPHORE_SHIFT = 4
+
+AUTO_SWITCH = 1  # флаг заголовка: стрелки ставятся по маршрутам (sim.auto_switch)
+
+TRAIN_ACTIVE = 1
+TRAIN_CRASHED = 2
+TRAIN_RETIRED = 4  # ушёл на последнем тике, пути освободятся на следующем
+
+VAGON_HEAD = 1
+VAGON_PRE_TAIL = 2
+VAGON_ACTIVE = 4
+
+NO_TRACK = 0xff  # вид пути у вагона без пути
+
+NONZERO = re.compile(rb'[^\x00]')
+STATS_FIELDS = ('delivered', 'crashed', 'reversals', 'trip_ticks')
+RANDOM_VERSION = 3  # версия состояния random.Random.getstate
+
+
+class SnapshotError(ValueError):
+    """Файл не снимок или снят с карты другого размера."""
+
+
+def is_snapshot(filename):
+    """Начинается ли файл с магии снимка."""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def read_grid_size(filename):
+    """Размер карты снимка по заголовку, чтобы создать под него симуляцию."""
+    with open(filename, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+        raise SnapshotError("%s: не снимок railway" % filename)
+    _, version, _, _, grid_x, grid_y, *_ = HEADER.unpack(header)
+    if version != VERSION:
+        raise SnapshotError("%s: не снимок railway версии %d" % (filename, VERSION))
+    return grid_x, grid_y
+
+
+def _coords(node):
+    return (node.x, node.y) if node else (-1, -1)
+
+
+def save_snapshot(sim, filename, construction_mode=True):
+    """Записывает состояние симуляции в двоичный снимок."""
+    gy = sim.grid_size_y
+    area = sim.grid_size_x * gy
+    kinds = len(TRACK_KINDS)
+    flags = bytearray(area)
+    colors = bytearray(area * 3)
+    switches = bytearray(area * 4)
+    enabled = bytearray((area * kinds + 7) // 8)
+    blocked = bytearray(len(enabled))
+
+    # у остальных узлов всё по умолчанию
+    nodes = set(sim.stations)
+    for track in sim.tracks.values():
+        nodes.add(track.node1)
+        nodes.add(track.node2)
+        bit = (track.node1.x * gy + track.node1.y) * kinds + track.key[2]
+        enabled[bit >> 3] |= 1 << (bit & 7)
+        if track.blocked:
+            blocked[bit >> 3] |= 1 << (bit & 7)
+
+    for node in nodes:
+        i = node.x * gy + node.y
+        closed = sum(1 << d for d, state in enumerate(node.semaphore_states) if not state)
+        flags[i] = (STATION if node.is_station else 0) | closed << SEMAPHORE_SHIFT
+        colors[i * 3:i * 3 + 3] = bytes(node.color)
+        switches[i * 4:i * 4 + 4] = node.active_track_index
+
+    crashes = [CRASH.pack(m, x, y) for m, matrix in enumerate(sim.crosses.matrixes)
+               for x, y in matrix.crashes]
+
+    _, words, gauss = sim.random.getstate()
+    state = RANDOM.pack(*words, gauss is not None, gauss or 0.0)
+    stats = STATS.pack(*(sim.stats[name] for name in STATS_FIELDS))
+
+    trains = []
+    vagons = []
+    groups = [(train, 0) for train in sim.trains] + [(train, TRAIN_RETIRED) for train in sim.retired]
+    for train, retired in groups:
+        train_flags = ((TRAIN_ACTIVE if train.is_active else 0) | (TRAIN_CRASHED if train.is_crached else 0)
+                       | retired)
+        trains.append(TRAIN.pack(*_coords(train.start_node), *train.color, train.t_type,
+                                 train_flags, len(train.vagons), train.started, train.reversals))
+        for vagon in train.vagons:
+            track = vagon.current_track
+            key = track.key if track else (-1, -1, NO_TRACK)
+            vagon_flags = ((VAGON_HEAD if vagon.is_head else 0) | (VAGON_PRE_TAIL if vagon.is_pre_tail else 0)
+                           | (VAGON_ACTIVE if vagon.is_active else 0))
+            vagons.append(VAGON.pack(*_coords(vagon.current_node), *_coords(vagon.start_node),
+                                     *_coords(vagon.end_node), *key, vagon_flags, vagon.progress))
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, bool(construction_mode), AUTO_SWITCH if sim.auto_switch else 0,
+                            sim.grid_size_x, gy, sim.tr_started, sim.ticks, len(crashes), len(trains), len(vagons)))
+        for section in (flags, colors, switches, enabled, blocked):
+            f.write(section)
+        f.write(b''.join(crashes))
+        f.write(stats)
+        f.write(state)
+        f.write(b''.join(trains))
+        f.write(b''.join(vagons))
+
+
+def _reset(sim):
+    """Возвращает к исходному состоянию всё, что могло отличаться от умолчаний."""
+    sim.release_trains()
+    nodes = set(sim.stations)
+    for track in sim.tracks.values():
+        nodes.add(track.node1)
+        nodes.add(track.node2)
+    for node in nodes:
+        node.color = (0, 0, 0)
+        node.is_station = False
+        node.semaphore_states[:] = b'\x01\x01\x01\x01'
+        node.active_track_index[:] = bytes(4)
+        node.clear_tracks()
+    sim.tracks.clear()
+    sim.virtual.clear()
+    sim.graph.clear()
+    sim.router.invalidate()  # маршруты строятся заново по загруженному графу
+    for matrix in sim.crosses.matrixes:
+        matrix.crashes.clear()
+
+
+def load_snapshot(sim, filename):
+    """Загружает снимок в симуляцию, возвращает режим конструирования."""
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if len(mm) < HEADER.size:
+            raise SnapshotError("%s: файл слишком короткий" % filename)
+        (magic, version, construction_mode, header_flags, grid_x, grid_y,
+         tr_started, ticks, n_crashes, n_trains, n_vagons) = HEADER.unpack_from(mm)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError("%s: не снимок railway версии %d" % (filename, VERSION))
+        if (grid_x, grid_y) != (sim.grid_size_x, sim.grid_size_y):
+            raise SnapshotError("%s: карта %dx%d, а не %dx%d"
+                                % (filename, grid_x, grid_y, sim.grid_size_x, sim.grid_size_y))
+
+        area = grid_x * grid_y
+        kinds = len(TRACK_KINDS)
+        bitset_size = (area * kinds + 7) // 8
+        size = (HEADER.size + area * 8 + bitset_size * 2
+                + n_crashes * CRASH.size + STATS.size + RANDOM.size
+                + n_trains * TRAIN.size + n_vagons * VAGON.size)
+        if len(mm) != size:
+            raise SnapshotError("%s: размер %d вместо %d" % (filename, len(mm), size))
+
+        _reset(sim)
+        nodes = sim.nodes
+
+        offset = HEADER.size
+        for m in NONZERO.finditer(mm, offset, offset + area):
+            i = m.start() - offset
+            node = nodes[i // grid_y][i % grid_y]
+            node.is_station = bool(mm[m.start()] & STATION)
+            closed = mm[m.start()] >> SEMAPHORE_SHIFT
+            for d in range(4):
+                node.semaphore_states[d] = 0 if closed >> d & 1 else 1
+        offset += area
+
+        for m in NONZERO.finditer(mm, offset, offset + area * 3):
+            i = (m.start() - offset) // 3
+            nodes[i // grid_y][i % grid_y].color = tuple(mm[offset + i * 3:offset + i * 3 + 3])
+        offset += area * 3
+
+        for m in NONZERO.finditer(mm, offset, offset + area * 4):
+            i = (m.start() - offset) // 4
+            d = (m.start() - offset) % 4
+            nodes[i // grid_y][i % grid_y].active_track_index[d] = mm[m.start()]
+        offset += area * 4
+
+        # кэш узлов пересчитываем один раз, а не на каждый путь
+        touched = set()
+        for m in NONZERO.finditer(mm, offset, offset + bitset_size):
+            byte = mm[m.start()]
+            for b in range(8):
+                if byte >> b & 1:
+                    bit = (m.start() - offset) * 8 + b
+                    i, kind = divmod(bit, kinds)
+                    track = sim.make_track((i // grid_y, i % grid_y, kind))
+                    track.enabled = True
+                    track.node1.add_track(track.n1_dir, track)
+                    track.node2.add_track(track.n2_dir, track)
+                    touched.add(track.node1)
+                    touched.add(track.node2)
+                    sim.register_track(track)
+        # граф читает node.dir_tracks, поэтому переписывается после кэша узлов
+        for node in touched:
+            node.update_index()
+            sim.graph.update_node(node)
+        offset += bitset_size
+
+        for m in NONZERO.finditer(mm, offset, offset + bitset_size):
+            byte = mm[m.start()]
+            for b in range(8):
+                if byte >> b & 1:
+                    i, kind = divmod((m.start() - offset) * 8 + b, kinds)
+                    sim.tracks[(i // grid_y, i % grid_y, kind)].blocked = True
+        offset += bitset_size
+
+        for _ in range(n_crashes):
+            m, x, y = CRASH.unpack_from(mm, offset)
+            offset += CRASH.size
+            sim.crosses.matrixes[m].crashes[(x, y)] = 1
+
+        sim.stats = dict(zip(STATS_FIELDS, STATS.unpack_from(mm, offset)))
+        offset += STATS.size
+        *words, has_gauss, gauss = RANDOM.unpack_from(mm, offset)
+        offset += RANDOM.size
+        sim.random.setstate((RANDOM_VERSION, tuple(words), gauss if has_gauss else None))
+
+        def node_at(x, y):
+            return nodes[x][y] if x >= 0 else None
+
+        vagon_offset = offset + n_trains * TRAIN.size
+        for _ in range(n_trains):
+            x, y, r, g, b, t_type, train_flags, count, started, reversals = TRAIN.unpack_from(mm, offset)
+            offset += TRAIN.size
+            train = sim.pool.take(nodes[x][y], (r, g, b), count, t_type)
+            train.is_active = bool(train_flags & TRAIN_ACTIVE)
+            train.is_crached = bool(train_flags & TRAIN_CRASHED)
+            train.started = started
+            train.reversals = reversals
+            train.release_occupancy()  # вагоны сейчас переставим
+            for vagon in train.vagons:
+                (cx, cy, sx, sy, ex, ey, tx, ty, kind,
+                 vagon_flags, progress) = VAGON.unpack_from(mm, vagon_offset)
+                vagon_offset += VAGON.size
+                vagon.current_node = node_at(cx, cy)
+                vagon.start_node = node_at(sx, sy)
+                vagon.end_node = node_at(ex, ey)
+                vagon.current_track = sim.get_track((tx, ty, kind)) if kind != NO_TRACK else None
+                vagon.is_head = bool(vagon_flags & VAGON_HEAD)
+                vagon.is_pre_tail = bool(vagon_flags & VAGON_PRE_TAIL)
+                vagon.is_active = bool(vagon_flags & VAGON_ACTIVE)
+                vagon.progress = progress
+                # поиск по пройденному пути продолжается с места после последнего тика
+                if sim.crosses.swept and vagon.is_active and vagon.current_track:
+                    vagon.trail = [(vagon.current_track, vagon.track_progress())]
+            train.update_positions(sim.cell_size)
+            train.update_positions(sim.cell_size)
+            # занятость путей и стрелок такая же, как после последнего тика: разбившиеся
+            # и ушедшие поезда держат пути, пока их не уберут на следующем тике
+            train.occupy_vagons()
+            (sim.retired if train_flags & TRAIN_RETIRED else sim.trains).append(train)
+
+    sim.collect_stations()
+    sim.auto_switch = bool(header_flags & AUTO_SWITCH)
+    sim.tr_started = tr_started
+    sim.ticks = ticks
+    if sim.kinematics:
+        sim.kinematics.invalidate()
+    return bool(construction_mode)
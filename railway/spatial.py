@@ -0,0 +1,76 @@
+HOVER_MARGIN = 5  # на сколько пикселей от линии путь ещё считается под курсором
+CLICK_RADIUS = 20  # радиус клика по стрелке, см. Node.click_commands
+
+
+class SpatialIndex:
+    """Сетка корзин по координатам холста для быстрого поиска объектов под курсором.
+
+    Объект кладётся во все корзины, которые задевает его прямоугольник,
+    поэтому запрос точки смотрит только одну корзину.
+    """
+
+    def __init__(self, bucket_size):
+        self.bucket_size = bucket_size
+        self.buckets = {}  # (bx, by) -> список объектов
+
+    def add(self, item, x_min, y_min, x_max, y_max):
+        bs = self.bucket_size
+        for bx in range(int(x_min // bs), int(x_max // bs) + 1):
+            for by in range(int(y_min // bs), int(y_max // bs) + 1):
+                self.buckets.setdefault((bx, by), []).append(item)
+
+    def query(self, x, y):
+        """Объекты, чьи прямоугольники могут содержать точку."""
+        bs = self.bucket_size
+        return self.buckets.get((int(x // bs), int(y // bs)), ())
+
+    def query_rect(self, x_min, y_min, x_max, y_max):
+        """Объекты, чьи прямоугольники могут пересекаться с прямоугольником."""
+        bs = self.bucket_size
+        found = set()
+        for bx in range(int(x_min // bs), int(x_max // bs) + 1):
+            for by in range(int(y_min // bs), int(y_max // bs) + 1):
+                found.update(self.buckets.get((bx, by), ()))
+        return found
+
+
+class RailwayIndex:
+    """Поиск путей и узлов одной карты по координатам холста.
+
+    Пути лежат на сетке, поэтому их не индексируем: кандидаты в
+    прямоугольнике перечисляет Simulation.candidate_keys.
+    """
+
+    def __init__(self, sim, cell_size):
+        self.sim = sim
+        self.cell_size = cell_size
+        self.nodes = SpatialIndex(cell_size)
+
+        # до узла дотягиваются клики по стрелкам и семафорам
+        reach = cell_size // 3 + CLICK_RADIUS
+        for row in sim.nodes:
+            for node in row:
+                x, y = node.getCanvasX(cell_size), node.getCanvasY(cell_size)
+                self.nodes.add(node, x - reach, y - reach, x + reach, y + reach)
+
+    def tracks_in_rect(self, x_min, y_min, x_max, y_max, built=False, keep=False):
+        """Пути, задевающие прямоугольник холста, в порядке отрисовки.
+
+        built=True - только построенные, иначе и виртуальные кандидаты.
+        """
+        cs = self.cell_size
+        half = cs // 2
+        keys = self.sim.candidate_keys((x_min - HOVER_MARGIN - half) / cs, (y_min - HOVER_MARGIN - half) / cs,
+                                       (x_max + HOVER_MARGIN - half) / cs, (y_max + HOVER_MARGIN - half) / cs)
+        if built:
+            return [track for track in map(self.sim.tracks.get, keys) if track]
+        return [self.sim.get_track(key, keep) for key in keys]
+
+    def hovered_tracks(self, x, y):
+        """Пути под курсором (обычно один, у узлов бывает несколько)."""
+        return [track for track in self.tracks_in_rect(x, y, x, y, keep=True)
+                if track.is_hovered(x, y, self.cell_size)]
+
+    def nodes_near(self, x, y):
+        """Узлы, до стрелок или семафоров которых можно дотянуться из точки."""
+        return self.nodes.query(x, y)
@@ -1,17 +1,34 @@
-import pygame
 import math
+from direction import dir_code
+from geometry import TrackGeometry, line_table, arc_table
+
+# возможные пути из узла (x, y): смещение node2 и направление дуги.
+# Номер вида входит в ключ пути (x, y, вид), ключи идут в порядке отрисовки
+TRACK_KINDS = (
+    (1, 0, None),
+    (0, 1, None),
+    (1, 1, 'hor'),
+    (1, 1, 'vert'),
+    (1, -1, 'hor'),
+    (1, -1, 'vert'),
+)
+
 
 class Track:
+    __slots__ = ('node1', 'node2', 'n1_dx', 'n1_dy', 'n2_dx', 'n2_dy', 'n1_dir', 'n2_dir',
+                 'enabled', 'blocked', 'bisy', 'geometry', 'key')
+
     def __init__(self, node1, node2):
         self.node1 = node1
         self.node2 = node2
-        self.n1_dx = self.sign(node2.x - node1.x)
-        self.n1_dy = self.sign(node2.y - node1.y)
-        self.n2_dx = -self.n1_dx
-        self.n2_dy = -self.n1_dy
-        self.enabled = False
+        self.n1_dx, self.n1_dy, self.n2_dx, self.n2_dy = self.get_exit_vectors()
+        self.n1_dir = dir_code(self.n1_dx, self.n1_dy)  # коды направлений выезда из узлов
+        self.n2_dir = dir_code(self.n2_dx, self.n2_dy)
+        self.enabled = False  # менять только через set_enabled, от него зависит кэш узлов
         self.blocked = False
-        self.bisy = False # занято поездом
+        self.bisy = 0  # сколько вагонов на пути, см. Train.occupy
+        self.geometry = None  # координаты на холсте, см. get_geometry
+        self.key = (node1.x, node1.y, self.get_kind())
 
     @staticmethod
     def sign(a):
@@ -23,16 +40,57 @@ class Track:
         else:
             return 0
 
+    def get_kind(self):
+        """Номер вида пути в TRACK_KINDS."""
+        return 0 if self.node2.x > self.node1.x else 1
+
+    def get_exit_vectors(self):
+        """Направления выезда (dx, dy) из node1 и из node2."""
+        n1_dx = self.sign(self.node2.x - self.node1.x)
+        n1_dy = self.sign(self.node2.y - self.node1.y)
+        return n1_dx, n1_dy, -n1_dx, -n1_dy
+
+    def get_geometry(self, cell_size):
+        """Координаты пути на холсте, пересчитываются только при смене размера клетки."""
+        geometry = self.geometry
+        if geometry is None or geometry.cell_size != cell_size:
+            geometry = self.geometry = self.make_geometry(cell_size)
+        return geometry
+
+    def make_geometry(self, cell_size):
+        x1, y1 = self.node1.getCanvasX(cell_size), self.node1.getCanvasY(cell_size)
+        x2, y2 = self.node2.getCanvasX(cell_size), self.node2.getCanvasY(cell_size)
+        return TrackGeometry(cell_size, x1, y1, x2, y2, line_table(x2 - x1, y2 - y1))
+
     def get_exit_direction(self, current_node):
         """Возвращает направление выезда из текущего узла."""
         if current_node == self.node1:
-            return (self.n1_dx, self.n1_dy)
+            return self.n1_dir
         else:
-            return (self.n2_dx, self.n2_dy)
+            return self.n2_dir
 
     def assign_to_nodes(self):
-        self.node1.outs[(self.n1_dx, self.n1_dy)].append(self)
-        self.node2.outs[(self.n2_dx, self.n2_dy)].append(self)
+        self.node1.add_track(self.n1_dir, self)
+        self.node2.add_track(self.n2_dir, self)
+        self.node1.update_index()
+        self.node2.update_index()
+
+    def remove_from_nodes(self):
+        self.node1.remove_track(self.n1_dir, self)
+        self.node2.remove_track(self.n2_dir, self)
+        self.node1.update_index()
+        self.node2.update_index()
+
+    def set_enabled(self, enabled):
+        """Включает/выключает путь. В узлах лежат только включённые пути,
+        выключенный путь - виртуальный кандидат, см. Simulation.get_track."""
+        if self.enabled == enabled:
+            return
+        self.enabled = enabled
+        if enabled:
+            self.assign_to_nodes()
+        else:
+            self.remove_from_nodes()
 
     def get_vector_for_node(self, node):
         if node == self.node1:
@@ -45,20 +103,6 @@ class Track:
         else:
             return -dx2 / 5, dy1
 
-    def get_color(self, is_hovered, construction_mode):
-        """Возвращает цвет пути в зависимости от его состояния и наведения."""
-        if self.enabled:
-            return (255, 0, 0) if is_hovered and construction_mode else (200, 200, 200)
-        else:
-            return (255, 100, 100) if is_hovered else (240, 240, 240)
-
-    def draw(self, screen, mouse_pos, construction_mode, cell_size):
-        color = self.get_color(self.is_hovered(*mouse_pos, cell_size), construction_mode)
-        width = 8 if self.enabled else 3
-        pygame.draw.line(screen, color,
-                         (self.node1.getCanvasX(cell_size), self.node1.getCanvasY(cell_size)),
-                         (self.node2.getCanvasX(cell_size), self.node2.getCanvasY(cell_size)), width)
-
     def get_other_node(self, node):
         return self.node1 if self.node2 == node else self.node2
 
@@ -67,17 +111,16 @@ class Track:
         if self.blocked or self.bisy:
             return False
 
-        x1, y1 = self.node1.getCanvasX(cell_size), self.node1.getCanvasY(cell_size)
-        x2, y2 = self.node2.getCanvasX(cell_size), self.node2.getCanvasY(cell_size)
+        g = self.get_geometry(cell_size)
+        x1, y1, x2, y2 = g.x1, g.y1, g.x2, g.y2
         if self.node1.x == self.node2.x:
-            if not (min(y1, y2) <= y <= max(y1, y2)):
+            if not (g.y_min <= y <= g.y_max):
                 return False
         else:
-            if not (min(x1, x2) <= x <= max(x1, x2)):
+            if not (g.x_min <= x <= g.x_max):
                 return False
         # Расстояние от точки до линии
-        line_length = math.hypot(x2 - x1, y2 - y1)
-        distance = abs((y2 - y1) * x - (x2 - x1) * y + x2 * y1 - y2 * x1) / line_length
+        distance = abs((y2 - y1) * x - (x2 - x1) * y + x2 * y1 - y2 * x1) / g.length
         return distance < 5
 
     def toggle(self):
@@ -86,49 +129,43 @@ class Track:
             return
 
         if self.enabled:
-            self.enabled = False
+            self.set_enabled(False)
         else:
             # Проверяем, можно ли добавить путь в обоих узлах
-            if self.node1.can_add_track((self.n1_dx, self.n1_dy)) and \
-                    self.node2.can_add_track((self.n2_dx, self.n2_dy)):
-                self.enabled = True
+            if self.node1.can_add_track(self.n1_dir) and \
+                    self.node2.can_add_track(self.n2_dir):
+                self.set_enabled(True)
 
     def get_position_on_track(self, progress, cell_size):
         """Возвращает координаты поезда на участке пути."""
-        x1, y1 = self.node1.getCanvasX(cell_size), self.node1.getCanvasY(cell_size)
-        x2, y2 = self.node2.getCanvasX(cell_size), self.node2.getCanvasY(cell_size)
-        x = x1 + (x2 - x1) * progress
-        y = y1 + (y2 - y1) * progress
-        return int(x), int(y)
+        return self.get_geometry(cell_size).position(progress)
 
 
 class CurvedTrack(Track):
+    __slots__ = ('direction',)
+
     def __init__(self, node1, node2, direction):
-        super().__init__(node1, node2)
         self.direction = direction
+        super().__init__(node1, node2)
+
+    def get_kind(self):
+        return (2 if self.node2.y > self.node1.y else 4) + (self.direction == 'vert')
+
+    def get_exit_vectors(self):
         if self.direction == 'hor':
-            self.n1_dx = 1
-            self.n1_dy = 0
-            self.n2_dx = 0
-            self.n2_dy = self.sign(node1.y - node2.y)
-        elif self.direction == 'vert':
-            self.n1_dx = 0
-            self.n1_dy = self.sign(node2.y - node1.y)
-            self.n2_dx = -1
-            self.n2_dy = 0
-
-    def draw(self, screen, mouse_pos, construction_mode, cell_size):
-        color = self.get_color(self.is_hovered(*mouse_pos, cell_size), construction_mode)
+            return 1, 0, 0, self.sign(self.node1.y - self.node2.y)
+        else:
+            return 0, self.sign(self.node2.y - self.node1.y), -1, 0
 
+    def make_geometry(self, cell_size):
         x1, y1 = self.node1.getCanvasX(cell_size), self.node1.getCanvasY(cell_size)
         x2, y2 = self.node2.getCanvasX(cell_size), self.node2.getCanvasY(cell_size)
 
-        width = 8 if self.enabled else 3
-
+        # центр дуги и углы, по которым поезд движется от node1 к node2
         if y2 > y1:
             if self.direction == 'hor':
                 center_x, center_y = x1, y2
-                start_angle, end_angle = 0, math.pi / 2
+                start_angle, end_angle = math.pi / 2, 0
             else:
                 center_x, center_y = x2, y1
                 start_angle, end_angle = math.pi, math.pi * 3 / 2
@@ -138,56 +175,26 @@ class CurvedTrack(Track):
                 start_angle, end_angle = -math.pi / 2, 0
             else:
                 center_x, center_y = x2, y1
-                start_angle, end_angle = math.pi / 2, math.pi
-
-        radius = cell_size + width //2
-
+                start_angle, end_angle = math.pi, math.pi / 2
 
-        arc_rect = (center_x - radius, center_y - radius, radius * 2, radius * 2)
-        pygame.draw.arc(screen, color, arc_rect, start_angle, end_angle, width)
+        table = arc_table(center_x - x1, center_y - y1, cell_size, start_angle, end_angle)
+        return TrackGeometry(cell_size, x1, y1, x2, y2, table,
+                             (center_x, center_y, start_angle, end_angle))
 
     def is_hovered(self, x, y, cell_size):
         """Проверяет, находится ли курсор рядом с дугой и внутри ограничивающего прямоугольника."""
         if self.blocked or self.bisy:
             return False
 
-        center_x = self.node1.getCanvasX(cell_size) if self.direction == 'hor' else self.node2.getCanvasX(cell_size)
-        center_y = self.node2.getCanvasY(cell_size) if self.direction == 'hor' else self.node1.getCanvasY(cell_size)
-
-        x_min, x_max = min(self.node1.getCanvasX(cell_size), self.node2.getCanvasX(cell_size)), max(
-            self.node1.getCanvasX(cell_size), self.node2.getCanvasX(cell_size))
-        y_min, y_max = min(self.node1.getCanvasY(cell_size), self.node2.getCanvasY(cell_size)), max(
-            self.node1.getCanvasY(cell_size), self.node2.getCanvasY(cell_size))
-
-        if not (x_min <= x <= x_max and y_min <= y <= y_max):
+        g = self.get_geometry(cell_size)
+        if not (g.x_min <= x <= g.x_max and g.y_min <= y <= g.y_max):
             return False
 
-        dx, dy = x - center_x, y - center_y
+        dx, dy = x - g.center_x, y - g.center_y
         distance = math.sqrt(dx ** 2 + dy ** 2)
         return abs(distance - cell_size) < 5
 
-    def get_position_on_track(self, progress, cell_size):
-        """Возвращает координаты поезда на дуге."""
-        x1, y1 = self.node1.getCanvasX(cell_size), self.node1.getCanvasY(cell_size)
-        x2, y2 = self.node2.getCanvasX(cell_size), self.node2.getCanvasY(cell_size)
-
-        if y2 > y1:
-            if self.direction == 'hor':
-                center_x, center_y = x1, y2
-                start_angle, end_angle = math.pi / 2, 0
-            else:
-                center_x, center_y = x2, y1
-                start_angle, end_angle = math.pi, math.pi * 3 / 2
-        else:
-            if self.direction == 'hor':
-                center_x, center_y = x1, y2
-                start_angle, end_angle = -math.pi / 2, 0
-            else:
-                center_x, center_y = x2, y1
-                start_angle, end_angle = math.pi, math.pi / 2
-
-        angle = start_angle + (end_angle - start_angle) * progress
-        radius = cell_size
-        x = center_x + radius * math.cos(angle)
-        y = center_y - radius * math.sin(angle)
-        return int(x), int(y)
+    def get_arc(self, cell_size):
+        """Центр дуги и углы, по которым движется поезд от node1 к node2."""
+        g = self.get_geometry(cell_size)
+        return g.center_x, g.center_y, g.start_angle, g.end_angle
@@ -1,27 +1,44 @@
-import pygame
 import math
 from node import Node
 from vagon import Vagon
+from direction import BIT_COUNT
 
 T_NORMAL = 1
 T_CRAZY = 2
 T_CRAFT = 3
 
 class Train:
+    __slots__ = ('is_active', 'is_crached', 'color', 't_type', 'start_node', 'vagons',
+                 'started', 'reversals', 'used_nodes', 'used_counts')
 
-    def __init__(self, start_node, color, vagon_count=2, t_type=T_NORMAL):
+    def __init__(self, start_node, color, vagon_count=2, t_type=T_NORMAL, spare=None):
+        self.used_nodes = []  # узлы, на путях которых стоят вагоны, см. use_node
+        self.used_counts = []  # по тем же номерам сколько вагонов на путях узла по направлениям
+        self.reset(start_node, color, vagon_count, t_type, spare)
+
+    def reset(self, start_node, color, vagon_count=2, t_type=T_NORMAL, spare=None):
+        """Ставит поезд на станцию как новый. Вагоны берутся из spare, если там есть."""
         self.is_active = True # Поезд активен
         self.is_crached = False # Поезд попал в аварию
         self.color = color  # Цвет поезда
         self.t_type = t_type  # Тип поезда
         self.start_node = start_node  # Исходная станция
+        self.started = 0  # тик симуляции, на котором поезд выехал
+        self.reversals = 0  # сколько раз разворачивался
+        self.used_nodes.clear()  # счётчики ушедшего поезда уже обнулены release_occupancy
         self.vagons = []
         for i in range(vagon_count):
-            vagon = Vagon(self,start_node, color, i==0)
+            if spare:
+                vagon = spare.pop()
+                vagon.reset(self, start_node, color, i==0)
+            else:
+                vagon = Vagon(self,start_node, color, i==0)
             if i==0 and vagon_count>1:
                 vagon.is_pre_tail = True
 
             self.vagons.append(vagon)
+            if vagon.is_active and vagon.current_track:
+                self.occupy(vagon.current_track)
 
 
     def update(self, nodes):
@@ -29,38 +46,79 @@ class Train:
         if not self.is_active:
             return
 
-        used_nodes = {}
         for vagon in self.vagons:
-
             vagon.update(nodes)
-            if vagon.is_active:
-                # определяем заблокированые направления узлов
-                ct = vagon.current_track
-                if not ct:
-                    continue
-                ct.bisy = True
-                n_k = (ct.node1.x,ct.node1.y)
-                n_d = (ct.n1_dx,ct.n1_dy)
-                if not n_k in used_nodes:
-                    used_nodes[n_k] = {}
-                used_nodes[n_k][n_d] = 1
-
-                n_k = (ct.node2.x, ct.node2.y)
-                n_d = (ct.n2_dx, ct.n2_dy)
-                if not n_k in used_nodes:
-                    used_nodes[n_k] = {}
-                used_nodes[n_k][n_d] = 1
-
-        if used_nodes:
-            for n_k in used_nodes:
-                if len(used_nodes[n_k])==2:
-                    x,y = n_k
-                    for direction in used_nodes[n_k]:
-                        nodes[x][y].blocked_dirs[direction] = 1
-
 
+    def occupy(self, track):
+        """Вагон поезда въехал на путь: путь занят, стрелки узлов могут блокироваться."""
+        track.bisy += 1
+        self.use_node(track.node1, track.n1_dir, 1)
+        self.use_node(track.node2, track.n2_dir, 1)
+
+    def release(self, track):
+        """Вагон поезда съехал с пути или ушёл с карты."""
+        track.bisy -= 1
+        self.use_node(track.node1, track.n1_dir, -1)
+        self.use_node(track.node2, track.n2_dir, -1)
+
+    def use_node(self, node, direction, delta):
+        """Считает вагоны поезда на путях узла по направлениям.
+
+        Если поезд занимает пути узла ровно в двух направлениях, он через
+        узел проезжает, и стрелки этих направлений блокируются.
+
+        Узлов у поезда всего несколько, поэтому они ищутся перебором, без
+        словаря. Счётчики освободившегося узла остаются за концом used_nodes
+        и достаются следующему узлу, так что переезд узла ничего не создаёт.
+        """
+        nodes = self.used_nodes
+        k = 0
+        count = len(nodes)
+        while k < count and nodes[k] is not node:
+            k += 1
+        if k == count:
+            nodes.append(node)
+            if k == len(self.used_counts):
+                self.used_counts.append([0, 0, 0, 0])
+        counts = self.used_counts[k]
+        old = self.used_dirs(counts)
+        counts[direction] += delta
+        new = self.used_dirs(counts)
+        if not new:
+            # на место узла ставим последний, обнулённые счётчики уходят за конец
+            last = len(nodes) - 1
+            nodes[k] = nodes[last]
+            nodes.pop()
+            self.used_counts[k], self.used_counts[last] = self.used_counts[last], self.used_counts[k]
+        if old != new:
+            if BIT_COUNT[old] == 2:
+                node.unblock(old)
+            if BIT_COUNT[new] == 2:
+                node.block(new)
+
+    @staticmethod
+    def used_dirs(counts):
+        return (counts[0] > 0) | (counts[1] > 0) << 1 | (counts[2] > 0) << 2 | (counts[3] > 0) << 3
+
+    def occupy_vagons(self):
+        """Занимает пути всех активных вагонов, когда вагоны расставлены снаружи (загрузка)."""
+        for vagon in self.vagons:
+            if vagon.is_active and vagon.current_track:
+                self.occupy(vagon.current_track)
 
+    def release_occupancy(self):
+        """Освобождает пути и стрелки поезда, ушедшего с карты."""
+        if not self.used_nodes:
+            return  # поезд ничего не занимал или уже освободил
+        for vagon in self.vagons:
+            if vagon.is_active and vagon.current_track:
+                self.release(vagon.current_track)
 
+    def update_positions(self, cell_size):
+        """Запоминает координаты вагонов после тика, по ним ищутся столкновения."""
+        for vagon in self.vagons:
+            # прошлые координаты нужны для интерполяции при отрисовке
+            vagon.prev_pos, vagon.pos = vagon.pos, vagon.get_position(cell_size)
 
     def reverse_direction(self):
         """Разворачиваем поезд по команде первого вагона"""
@@ -84,6 +142,7 @@ class Train:
         if not first_vagon:
             return
 
+        self.reversals += 1
         if first_vagon.is_head:
             # поезд ехал носом
             first_vagon.is_head = False
@@ -116,6 +175,8 @@ class Train:
         else:
             sor_vagon.is_active = False
             sor_vagon.is_head = False
+            if sor_vagon.current_track:
+                self.release(sor_vagon.current_track)
 
             new_first_vagon = None
             new_last_vagon = None
@@ -145,15 +206,35 @@ class Train:
 
         if first_unactive:
             first_unactive.is_active = True
+            if first_unactive.current_track:
+                self.occupy(first_unactive.current_track)
             sor_vagon.is_pre_tail = False
             if unact_cnt>1:
                 first_unactive.is_pre_tail = True
 
 
-    def draw(self, screen, cell_size, crosses):
-        """Рисует поезд."""
-        if not self.is_active:
-            return
+class TrainPool:
+    """Ушедшие с карты поезда и их вагоны для новых поездов.
 
-        for vagon in self.vagons:
-            vagon.draw(screen, cell_size, crosses)
+    За долгую игру поезда выпускаются тысячами, с пулом новые объекты
+    создаются, только пока поездов на карте больше, чем было до сих пор.
+    Поезд отдаётся в пул, когда на него больше никто не ссылается:
+    пути освобождены (release_occupancy) и он убран из Simulation.trains.
+    """
+
+    def __init__(self):
+        self.trains = []
+        self.vagons = []
+
+    def take(self, start_node, color, vagon_count=2, t_type=T_NORMAL):
+        """Поезд на станции start_node, как Train(...)."""
+        if self.trains:
+            train = self.trains.pop()
+            train.reset(start_node, color, vagon_count, t_type, self.vagons)
+            return train
+        return Train(start_node, color, vagon_count, t_type, self.vagons)
+
+    def give(self, train):
+        self.vagons.extend(train.vagons)
+        train.vagons = []
+        self.trains.append(train)
@@ -1,14 +1,27 @@
-import pygame
 import math
 from track import Track, CurvedTrack
 from node import Node
-from crosses import Crosses
+from direction import opposite
 
 VAGON_LEN = 0.3 #длина вагона в единицах прогресса
+CURVE_SPEED = 0.7 # коэффициент скорости на дуге
 T_CRAFT = 3
 
+
+def vagon_step(track):
+    """Сдвиг прогресса за тик на пути, как в Vagon.update."""
+    return 0.01 * (CURVE_SPEED if isinstance(track, CurvedTrack) else 1.0)
+
+
 class Vagon:
+    __slots__ = ('train', 'current_node', 'is_head', 'is_pre_tail', 'is_active', 'color',
+                 'current_track', 'progress', 'start_node', 'end_node', 'pos', 'prev_pos', 'trail')
+
     def __init__(self, train, start_node, color, is_head):
+        self.reset(train, start_node, color, is_head)
+
+    def reset(self, train, start_node, color, is_head):
+        """Ставит вагон на станцию как новый, вагоны переиспользуются через TrainPool."""
         self.train = train
         self.current_node = start_node
         self.is_head = is_head  # мы голова
@@ -19,14 +32,16 @@ class Vagon:
         self.progress = 0  # Прогресс движения между узлами (0..1)
         self.start_node = None  # Начальный узел текущего участка
         self.end_node = None  # Конечный узел текущего участка
+        self.pos = None  # Координаты на холсте после последнего тика
+        self.prev_pos = None  # Координаты на холсте после предыдущего тика
+        self.trail = None  # точки пути (путь, прогресс от node1) для Crosses.sweep_trains
 
         # Инициализация начального участка
         self.set_initial_track()
 
     def set_initial_track(self):
         """Устанавливает начальный участок пути."""
-        for direction in self.current_node.outs:
-            active_tracks =  self.current_node.get_dir_tracks(direction)
+        for active_tracks in self.current_node.dir_tracks:
             if active_tracks:
                 self.current_track = active_tracks[0]
                 self.start_node = self.current_node
@@ -42,7 +57,7 @@ class Vagon:
         speed_coefficient = 1.0
         if isinstance(self.current_track, CurvedTrack):
             # Длина дуги больше, чем прямой участок, поэтому замедляем движение
-            speed_coefficient = 0.7  # Можно настроить в зависимости от радиуса дуги
+            speed_coefficient = CURVE_SPEED  # Можно настроить в зависимости от радиуса дуги
 
         # Двигаем поезд
         self.progress += 0.01 * speed_coefficient  # Скорость движения с учётом коэффициента
@@ -54,6 +69,8 @@ class Vagon:
         if self.progress >= 1:
 
             # Поезд доехал до конца участка
+            if self.trail is not None:
+                self.trail.append((self.current_track, self.track_progress()))
 
             # Если поезд достиг терминального узла
 
@@ -92,12 +109,15 @@ class Vagon:
     def set_next_track(self):
         """Определяет следующий участок пути с учётом стрелки."""
         # Получаем направление выезда из текущего узла
-        exit_direction = (-self.current_track.get_exit_direction(self.end_node)[0],
-                          -self.current_track.get_exit_direction(self.end_node)[1])
+        exit_direction = opposite(self.current_track.get_exit_direction(self.end_node))
 
         # Получаем активный участок пути с учётом стрелки
         active_track = self.current_node.get_active_track(exit_direction)
         if active_track:
+            if self.trail is not None:
+                self.trail.append((active_track, 0.0 if active_track.node1 == self.current_node else 1.0))
+            self.train.release(self.current_track)
+            self.train.occupy(active_track)
             self.current_track = active_track
             self.start_node = self.current_node
             self.end_node = self.current_track.get_other_node(self.current_node)
@@ -109,6 +129,8 @@ class Vagon:
 
     def reverse_direction(self):
         """Разворачивает поезд на текущем участке пути."""
+        if self.trail is not None and self.current_track:
+            self.trail.append((self.current_track, self.track_progress()))
         self.start_node, self.end_node = self.end_node, self.start_node
         self.progress = 1-self.progress  # Сбрасываем прогресс
 
@@ -126,15 +148,28 @@ class Vagon:
 
         return True
 
-    def draw(self, screen, cell_size, crosses):
-        """Рисует поезд."""
+    def track_progress(self):
+        """Прогресс в координатах пути: 0 у node1, 1 у node2."""
+        if self.current_track.node1 == self.start_node:
+            return self.progress
+        return 1 - self.progress
+
+    def get_position(self, cell_size):
+        """Возвращает координаты вагона на холсте или None, если его нет на карте."""
         if not self.is_active or not self.current_track:
-            return
+            return None
 
         # Получаем координаты поезда на участке пути
         if self.current_track.node1 == self.start_node:
-            x, y = self.current_track.get_position_on_track(self.progress, cell_size)
+            return self.current_track.get_position_on_track(self.progress, cell_size)
         else:
-            x, y = self.current_track.get_position_on_track(1 - self.progress, cell_size)
-        pygame.draw.circle(screen, self.color, (x, y), 8)
-        crosses.add_point(x,y)
+            return self.current_track.get_position_on_track(1 - self.progress, cell_size)
+
+    def get_draw_position(self, cell_size, alpha=1.0):
+        """Координаты для отрисовки: между двумя последними тиками с долей alpha."""
+        pos = self.get_position(cell_size)
+        if not pos or not self.prev_pos or alpha >= 1:
+            return pos
+        x0, y0 = self.prev_pos
+        x1, y1 = pos
+        return int(x0 + (x1 - x0) * alpha), int(y0 + (y1 - y0) * alpha)